@@ -1,17 +1,15 @@
 import os
-import subprocess
+import sys
 
 if not os.environ.get("VIRTUAL_ENV"):
-    print("Not running in a virtual environment. Launching 'poetry shell'...")
-    with open("start_error_log.txt", "w") as error_file:
-        subprocess.run(
-            "poetry run python start.py",
-            shell=True,
-            stderr=error_file,
-        )
-else:
-    from dotenv import load_dotenv
+    print(
+        "Not running in a virtual environment. Relaunching with 'poetry run'...",
+        flush=True,
+    )
+    # Replace this process rather than spawning a shell that spawns poetry
+    os.execvp("poetry", ["poetry", "run", "python", *sys.argv])
 
-    load_dotenv()
-    command = "interpreter"
-    subprocess.run(command, shell=True)
+from dotenv import load_dotenv
+
+load_dotenv()
+os.execvp("interpreter", ["interpreter"])
@@ -0,0 +1,147 @@
+import asyncio
+import re
+
+import pytest
+
+from work.fingertips.confluence.managers import aichat
+from work.fingertips.confluence.managers.aichat import (
+    _MISSING,
+    AIChatManager,
+    iter_text_chunks,
+)
+
+
+@pytest.fixture
+def manager():
+    return AIChatManager(
+        "What is the API URL?", "https://example.atlassian.net", "user", "token"
+    )
+
+
+def test_chunk_calls_get_the_chunk_answering_prompt(manager):
+    assert manager.system_prompt == aichat.CHUNK_ANSWER_INSTRUCTIONS
+
+
+def test_iter_text_chunks_sizes():
+    html = "<p>" + "x" * 25 + "</p>"
+    assert list(iter_text_chunks(html, size=10)) == ["x" * 10, "x" * 10, "x" * 5 + " "]
+
+
+def test_iter_text_chunks_entity_split_across_feeds():
+    html = "<p>Fish &amp; chips &eacute;t&eacute;</p>"
+    for feed_size in range(1, len(html) + 1):
+        text = "".join(iter_text_chunks(html, size=1000, feed_size=feed_size))
+        assert text.strip() == "Fish & chips été"
+
+
+def test_iter_text_chunks_words_split_across_feeds():
+    html = "<div>hello</div><div>world</div>"
+    text = "".join(iter_text_chunks(html, size=1000, feed_size=3))
+    assert text.split() == ["hello", "world"]
+
+
+def test_iter_text_chunks_skips_script_and_style():
+    html = (
+        "<style>p { color: red; }</style><p>visible</p>"
+        "<script>var hidden = '<p>no</p>';</script><p>text</p>"
+    )
+    text = "".join(iter_text_chunks(html, size=1000, feed_size=7))
+    assert text.split() == ["visible", "text"]
+
+
+def test_group_chunks_caps_group_size(manager, monkeypatch):
+    monkeypatch.setattr(aichat, "CHUNK_GROUP_SIZE", 3)
+    groups = list(manager.group_chunks(["a"] * 7))
+    assert groups == [["a"] * 3, ["a"] * 3, ["a"]]
+
+
+def test_group_chunks_respects_context_budget(manager, monkeypatch):
+    overhead = len(manager.chunk_group_query([]))
+    monkeypatch.setattr(aichat, "CONTEXT_LIMIT", overhead + 10)
+    monkeypatch.setattr(aichat, "CHUNK_GROUP_SIZE", 100)
+    groups = list(manager.group_chunks(["aaaa", "bbbb", "cc", "dddddd", "e" * 20]))
+    # A chunk larger than the budget still gets a group of its own
+    assert groups == [["aaaa", "bbbb", "cc"], ["dddddd"], ["e" * 20]]
+
+
+def test_group_chunks_is_lazy(manager, monkeypatch):
+    monkeypatch.setattr(aichat, "CHUNK_GROUP_SIZE", 2)
+    consumed = []
+
+    def chunks():
+        for chunk in "abcde":
+            consumed.append(chunk)
+            yield chunk
+
+    groups = manager.group_chunks(chunks())
+    assert next(groups) == ["a", "b"]
+    # The first group is yielded once the third chunk shows it is full
+    assert consumed == ["a", "b", "c"]
+
+
+def test_match_group_answers_by_context(manager):
+    responses = [
+        {"context": 3, "answer": "third"},
+        {"context": 1, "answer": "first"},
+        {"context": 1, "answer": "duplicate"},
+        {"context": 9, "answer": "out of range"},
+        {"answer": "no context"},
+    ]
+    assert manager.match_group_answers(responses, 3) == ["first", _MISSING, "third"]
+
+
+class FakeChat:
+    """Stands in for AsyncAIChat, answering each chunk with its own text."""
+
+    def __init__(self, fail_groups=False, fail_chunks=()):
+        self.fail_groups = fail_groups
+        self.fail_chunks = fail_chunks
+        self.calls = []
+
+    async def __call__(self, prompt, params=None, output_schema=None, **kwargs):
+        self.calls.append((output_schema, params))
+        contexts = re.findall(r"CONTEXT \d+:\n(\S+)", prompt)
+        if output_schema is aichat.answer_group_output:
+            if self.fail_groups:
+                raise ValueError("truncated function call")
+            return {
+                "answers": [
+                    {"context": i, "answer": f"about {chunk}"}
+                    for i, chunk in enumerate(contexts, start=1)
+                ]
+            }
+        chunk = prompt.split("Context:")[1].split()[0]
+        if chunk in self.fail_chunks:
+            raise ValueError("truncated function call")
+        return {"answer": f"about {chunk}"}
+
+
+@pytest.fixture
+def fresh_answers(monkeypatch):
+    monkeypatch.setattr(aichat, "chunk_answers", aichat.ChunkAnswerCache())
+
+
+def answer(manager, chat, chunks):
+    manager._async_ai = chat
+    return asyncio.run(manager.answer_chunks(chunks, asyncio.Semaphore(5)))
+
+
+def test_group_max_tokens_scale_with_group_size(manager, fresh_answers, monkeypatch):
+    monkeypatch.setattr(aichat, "CHUNK_GROUP_SIZE", 3)
+    chat = FakeChat()
+    answers = answer(manager, chat, ["one", "two", "three"])
+    assert answers == ["about one", "about two", "about three"]
+    assert chat.calls == [
+        (aichat.answer_group_output, manager.chat_params(3)),
+    ]
+    assert manager.chat_params(3)["max_tokens"] == 3 * aichat.CHUNK_ANSWER_MAX_TOKENS
+
+
+def test_failed_group_falls_back_to_single_chunks(manager, fresh_answers, monkeypatch):
+    monkeypatch.setattr(aichat, "CHUNK_GROUP_SIZE", 2)
+    chat = FakeChat(fail_groups=True, fail_chunks=("two",))
+    answers = answer(manager, chat, ["one", "two", "three"])
+    # "two" failed on its own too, so it has no answer but the query goes on
+    assert answers == ["about one", None, "about three"]
+    key = aichat.chunk_answers.key(manager.user_query, "two")
+    assert aichat.chunk_answers.get(key) is _MISSING
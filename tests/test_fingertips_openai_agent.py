@@ -0,0 +1,180 @@
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+# The agent builds its OpenAI client at construction
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+
+from work.fingertips.confluence.agents.openai import OpenAIAgent, RunError  # noqa: E402
+
+
+def tool_call(call_id, name, **arguments):
+    return SimpleNamespace(
+        id=call_id,
+        function=SimpleNamespace(name=name, arguments=json.dumps(arguments)),
+    )
+
+
+def run_event(event, status=None, tool_calls=None):
+    run = SimpleNamespace(id="run_1", status=status, last_error=None)
+    if tool_calls is not None:
+        run.required_action = SimpleNamespace(
+            submit_tool_outputs=SimpleNamespace(tool_calls=tool_calls)
+        )
+    return SimpleNamespace(event=event, data=run)
+
+
+class FakeStream:
+    """An AssistantStreamManager over a fixed list of events."""
+
+    def __init__(self, events):
+        self.events = events
+
+    def __enter__(self):
+        return iter(self.events)
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeRuns:
+    """Serves one stream per call: the run's, then one per tool output submission."""
+
+    def __init__(self, streams):
+        self.streams = list(streams)
+        self.submitted = []
+
+    def stream(self, thread_id, assistant_id):
+        return FakeStream(self.streams.pop(0))
+
+    def submit_tool_outputs_stream(self, thread_id, run_id, tool_outputs):
+        self.submitted.append(tool_outputs)
+        return FakeStream(self.streams.pop(0))
+
+
+class FakeConfluence:
+    def search_confluence(self, cql_query):
+        if cql_query == "broken":
+            raise ConnectionError("Confluence is down")
+        return {"size": 1, "results": [{"title": cql_query}]}
+
+    def load_confluence_page(self, page_or_content_id):
+        return f"<p>page {page_or_content_id}</p>"
+
+
+@pytest.fixture
+def agent():
+    agent = OpenAIAgent(FakeConfluence())
+    agent._assistant = SimpleNamespace(id="asst_1")
+    return agent
+
+
+def install(agent, *streams):
+    runs = FakeRuns(streams)
+    agent._openai_client = SimpleNamespace(
+        beta=SimpleNamespace(
+            threads=SimpleNamespace(
+                runs=runs,
+                create=lambda: SimpleNamespace(id="thread_1"),
+                messages=SimpleNamespace(
+                    create=lambda **kwargs: SimpleNamespace(id="msg_1"),
+                    list=lambda **kwargs: ["reply"],
+                ),
+            )
+        )
+    )
+    return runs
+
+
+def test_all_tool_outputs_are_submitted_at_once(agent):
+    calls = [
+        tool_call("call_1", "search_confluence", cql_query="text ~ 'api'"),
+        tool_call("call_2", "load_confluence_page", page_or_content_id="42"),
+    ]
+    runs = install(
+        agent,
+        [run_event("thread.run.requires_action", tool_calls=calls)],
+        [run_event("thread.run.completed", status="completed")],
+    )
+    agent.stream_run("thread_1")
+
+    [outputs] = runs.submitted
+    assert [output["tool_call_id"] for output in outputs] == ["call_1", "call_2"]
+    assert json.loads(outputs[0]["output"])["results"] == [{"title": "text ~ 'api'"}]
+    assert json.loads(outputs[1]["output"]) == "<p>page 42</p>"
+
+
+def test_failed_tool_calls_are_submitted_as_errors(agent):
+    calls = [
+        tool_call("call_1", "search_confluence", cql_query="broken"),
+        tool_call("call_2", "delete_everything"),
+        SimpleNamespace(
+            id="call_3",
+            function=SimpleNamespace(name="search_confluence", arguments="{"),
+        ),
+    ]
+    runs = install(
+        agent,
+        [run_event("thread.run.requires_action", tool_calls=calls)],
+        [run_event("thread.run.completed", status="completed")],
+    )
+    assert agent.stream_run("thread_1").status == "completed"
+
+    errors = [json.loads(output["output"])["error"] for output in runs.submitted[0]]
+    assert errors[0] == "ConnectionError: Confluence is down"
+    assert errors[1] == "Unknown tool: delete_everything"
+    assert errors[2].startswith("JSONDecodeError")
+
+
+def test_stream_returns_the_completed_run(agent):
+    install(
+        agent,
+        [
+            run_event("thread.run.created"),
+            run_event("thread.run.in_progress"),
+            run_event("thread.run.completed", status="completed"),
+        ],
+    )
+    assert agent.stream_run("thread_1").status == "completed"
+
+
+def test_stream_continues_after_each_tool_submission(agent):
+    search = [tool_call("call_1", "search_confluence", cql_query="text ~ 'api'")]
+    load = [tool_call("call_2", "load_confluence_page", page_or_content_id="42")]
+    runs = install(
+        agent,
+        [run_event("thread.run.requires_action", tool_calls=search)],
+        [run_event("thread.run.requires_action", tool_calls=load)],
+        [run_event("thread.run.completed", status="completed")],
+    )
+    assert agent.stream_run("thread_1").status == "completed"
+    assert [outputs[0]["tool_call_id"] for outputs in runs.submitted] == [
+        "call_1",
+        "call_2",
+    ]
+
+
+def test_stream_that_ends_early_returns_none(agent):
+    install(agent, [run_event("thread.run.in_progress")])
+    assert agent.stream_run("thread_1") is None
+
+
+@pytest.mark.parametrize(
+    "events",
+    [
+        [run_event("thread.run.failed", status="failed")],
+        [run_event("thread.run.expired", status="expired")],
+        [run_event("thread.run.in_progress")],
+    ],
+)
+def test_send_message_raises_when_the_run_does_not_complete(agent, events):
+    install(agent, events)
+    with pytest.raises(RunError):
+        agent.send_message("What is the API URL?", "C1")
+
+
+def test_send_message_returns_the_replies(agent):
+    install(agent, [run_event("thread.run.completed", status="completed")])
+    assert agent.send_message("What is the API URL?", "C1") == ["reply"]
@@ -0,0 +1,92 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from work.fingertips.confluence.managers.openai import OpenAIManager
+
+
+def message(text):
+    return SimpleNamespace(
+        content=[SimpleNamespace(type="text", text=SimpleNamespace(value=text))]
+    )
+
+
+def result(index):
+    return {
+        "title": f"Page {index}",
+        "content": {"_links": {"webui": f"/pages/{index}"}},
+    }
+
+
+class FakeAgent:
+    """Replies to the question about result i with replies[i] after delays[i]."""
+
+    def __init__(self, replies, delays):
+        self.replies = replies
+        self.delays = delays
+        self.forgotten = []
+        self.release = threading.Event()
+
+    def send_message(self, message_text, thread_key):
+        index = int(thread_key.rsplit(":", 1)[1])
+        delay = self.delays[index]
+        if delay is None:
+            self.release.wait(5)
+        else:
+            time.sleep(delay)
+        reply = self.replies[index]
+        if isinstance(reply, Exception):
+            raise reply
+        return [message(reply)]
+
+    def forget_openai_thread(self, thread_key):
+        self.forgotten.append(thread_key)
+
+
+@pytest.fixture
+def manager():
+    return OpenAIManager("https://example.atlassian.net", "user", "token")
+
+
+def answer(manager, agent):
+    manager._agent = agent
+    results = {"results": [result(i) for i in range(len(agent.replies))]}
+    return manager.formulate_answer("What is the API URL?", results, "C1")
+
+
+def test_failure_replies_are_not_answers(manager):
+    agent = FakeAgent(
+        ["failure: I'm sorry, inadequate info.", "The URL is api.example.com"],
+        [0, 0.05],
+    )
+    assert "*Page 1*" in answer(manager, agent)
+
+
+def test_higher_ranked_answer_wins_over_a_faster_one(manager):
+    agent = FakeAgent(["From page 0", "From page 1"], [0.1, 0])
+    assert "*Page 0*" in answer(manager, agent)
+
+
+def test_failed_calls_do_not_block_lower_ranked_answers(manager):
+    agent = FakeAgent(
+        [RuntimeError("run failed"), "failure: no", "From page 2"], [0.05, 0, 0]
+    )
+    assert "*Page 2*" in answer(manager, agent)
+
+
+def test_returns_without_waiting_for_lower_ranked_calls(manager):
+    agent = FakeAgent(["From page 0", "From page 1"], [0, None])
+    started = time.monotonic()
+    try:
+        assert "*Page 0*" in answer(manager, agent)
+        assert time.monotonic() - started < 1
+    finally:
+        agent.release.set()
+
+
+def test_no_answers(manager):
+    agent = FakeAgent(["failure: no", ""], [0, 0])
+    assert answer(manager, agent).startswith("I found some information, but nothing")
+    assert sorted(agent.forgotten) == ["C1:0", "C1:1"]
@@ -0,0 +1,169 @@
+import pytest
+
+from work.fingertips.confluence.clients import redis_cache
+from work.fingertips.confluence.clients.redis_cache import RedisCache
+from work.fingertips.confluence.clients.semantic_cache import SemanticCache
+
+
+class FakeRedis:
+    """The subset of redis.Redis that RedisCache uses, on a settable clock."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.values = {}
+        self.expires = {}
+        self.sets = {}
+        self.calls = []
+
+    def expired(self, key):
+        if key in self.expires and self.expires[key] <= self.now:
+            self.values.pop(key, None)
+            self.sets.pop(key, None)
+            del self.expires[key]
+
+    def get(self, key):
+        self.calls.append("get")
+        self.expired(key)
+        return self.values.get(key)
+
+    def setex(self, key, ttl, value):
+        self.values[key] = value.encode()
+        self.expires[key] = self.now + ttl
+
+    def delete(self, key):
+        self.values.pop(key, None)
+        self.sets.pop(key, None)
+
+    def mget(self, keys):
+        self.calls.append("mget")
+        return [self.get(key) for key in keys]
+
+    def zadd(self, key, mapping):
+        self.sets.setdefault(key, {}).update(mapping)
+
+    def zremrangebyscore(self, key, low, high):
+        members = self.sets.get(key, {})
+        for member, score in list(members.items()):
+            if score <= high:
+                del members[member]
+
+    def zremrangebyrank(self, key, start, stop):
+        members = self.sets.get(key, {})
+        ranked = sorted(members, key=members.get)
+        for member in ranked[start : stop + 1 or None]:
+            del members[member]
+
+    def zrangebyscore(self, key, low, high):
+        self.calls.append("zrangebyscore")
+        self.expired(key)
+        members = self.sets.get(key, {})
+        return [
+            m.encode() for m in sorted(members, key=members.get) if members[m] >= low
+        ]
+
+    def expire(self, key, ttl):
+        self.expires[key] = self.now + ttl
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def execute(self):
+        pass
+
+
+@pytest.fixture
+def client(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(redis_cache.redis.Redis, "from_url", lambda url: fake)
+    monkeypatch.setattr(redis_cache.time, "time", lambda: fake.now)
+    return fake
+
+
+@pytest.fixture
+def cache(client):
+    return RedisCache("redis://fake", prefix="test:")
+
+
+def test_get_set_round_trip(cache, client):
+    cache.set("key", {"a": [1, 2]}, ttl=10)
+    assert cache.get("key") == {"a": [1, 2]}
+    client.now += 10
+    assert cache.get("key") is None
+
+
+def test_index_members_expire_individually(cache, client):
+    cache.index_add("answers", "old", "first", ttl=60, maxsize=10)
+    client.now += 30
+    cache.index_add("answers", "new", "second", ttl=60, maxsize=10)
+    client.now += 40
+
+    # Writing "new" renewed the index key, but "old" is past its own ttl
+    assert cache.index_members("answers", ttl=60) == ["new"]
+    assert cache.index_get("answers", ["old", "new"]) == {"new": "second"}
+
+
+def test_index_add_trims_to_the_newest_members(cache, client):
+    for i in range(5):
+        cache.index_add("answers", f"m{i}", i, ttl=60, maxsize=3)
+        client.now += 1
+    assert cache.index_members("answers", ttl=60) == ["m2", "m3", "m4"]
+
+
+def test_index_add_drops_members_older_than_ttl(cache, client):
+    cache.index_add("answers", "old", 1, ttl=60, maxsize=10)
+    client.now += 61
+    cache.index_add("answers", "new", 2, ttl=60, maxsize=10)
+    assert client.sets["test:answers"] == {"new": client.now}
+
+
+def test_index_get_without_members_skips_redis(cache, client):
+    assert cache.index_get("answers", []) == {}
+    assert client.calls == []
+
+
+EMBEDDINGS = {"What is the API URL?": [1.0, 0.0], "How do I onboard?": [0.0, 1.0]}
+
+
+def test_semantic_cache_shares_answers_between_workers(cache):
+    first = SemanticCache(embed=EMBEDDINGS.get, shared=cache)
+    second = SemanticCache(embed=EMBEDDINGS.get, shared=cache)
+    first.get_or_answer("C1", "What is the API URL?", lambda: "from first")
+    assert (
+        second.get_or_answer("C1", "What is the API URL?", lambda: "from second")
+        == "from first"
+    )
+
+
+def test_semantic_cache_hit_in_memory_skips_redis(cache, client):
+    worker = SemanticCache(embed=EMBEDDINGS.get, shared=cache)
+    worker.get_or_answer("C1", "What is the API URL?", lambda: "answer")
+    client.calls.clear()
+    assert worker.get_or_answer("C1", "What is the API URL?", lambda: "") == "answer"
+    assert client.calls == []
+
+    worker.get_or_answer("C1", "How do I onboard?", lambda: "onboarding")
+    assert client.calls[0] == "zrangebyscore"
+
+
+def test_semantic_cache_invalidate_stops_reloading_from_redis(cache):
+    first = SemanticCache(embed=EMBEDDINGS.get, shared=cache)
+    second = SemanticCache(embed=EMBEDDINGS.get, shared=cache)
+    first.get_or_answer("C1", "What is the API URL?", lambda: "stale")
+    first.invalidate("C1")
+    assert (
+        second.get_or_answer("C1", "What is the API URL?", lambda: "fresh") == "fresh"
+    )
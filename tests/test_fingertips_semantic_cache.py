@@ -0,0 +1,149 @@
+import pytest
+
+from work.fingertips.confluence.clients import semantic_cache
+from work.fingertips.confluence.clients.semantic_cache import SemanticCache
+
+EMBEDDINGS = {
+    "What is the API URL?": [1.0, 0.0, 0.0],
+    "Where is the API URL?": [0.99, 0.1, 0.0],
+    "Which API URL do I use?": [0.8, 0.6, 0.0],
+    "How do I onboard?": [0.0, 0.0, 1.0],
+    "Who owns billing?": [0.0, 1.0, 0.0],
+}
+
+
+def embed(query):
+    return EMBEDDINGS[query]
+
+
+class Answers:
+    """Counts answer() calls so hits and misses can be told apart."""
+
+    def __init__(self, response="answer"):
+        self.response = response
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.response
+
+
+def test_paraphrase_above_threshold_is_a_hit():
+    cache = SemanticCache(embed=embed, threshold=0.92)
+    answers = Answers()
+    assert cache.get_or_answer("C1", "What is the API URL?", answers) == "answer"
+    assert cache.get_or_answer("C1", "Where is the API URL?", answers) == "answer"
+    assert answers.calls == 1
+
+
+def test_query_below_threshold_is_a_miss():
+    cache = SemanticCache(embed=embed, threshold=0.92)
+    answers = Answers()
+    cache.get_or_answer("C1", "What is the API URL?", answers)
+    # Cosine similarity 0.8
+    cache.get_or_answer("C1", "Which API URL do I use?", answers)
+    cache.get_or_answer("C1", "How do I onboard?", answers)
+    assert answers.calls == 3
+
+
+def test_scopes_are_isolated():
+    cache = SemanticCache(embed=embed)
+    cache.get_or_answer("C1", "What is the API URL?", Answers("for C1"))
+    answers = Answers("for C2")
+    assert cache.get_or_answer("C2", "What is the API URL?", answers) == "for C2"
+    assert answers.calls == 1
+    assert cache.get_or_answer("C1", "Where is the API URL?", Answers()) == "for C1"
+
+
+def test_invalidate_scope():
+    cache = SemanticCache(embed=embed)
+    cache.get_or_answer("C1", "What is the API URL?", Answers())
+    cache.get_or_answer("C2", "What is the API URL?", Answers())
+    cache.invalidate("C1")
+
+    answers = Answers()
+    cache.get_or_answer("C1", "What is the API URL?", answers)
+    cache.get_or_answer("C2", "What is the API URL?", answers)
+    assert answers.calls == 1
+
+
+def test_empty_answers_are_not_cached():
+    cache = SemanticCache(embed=embed)
+    cache.get_or_answer("C1", "What is the API URL?", Answers(""))
+    answers = Answers()
+    assert cache.get_or_answer("C1", "What is the API URL?", answers) == "answer"
+    assert answers.calls == 1
+
+
+def test_embedding_failure_falls_through_to_answer():
+    def failing_embed(query):
+        raise RuntimeError("embeddings unavailable")
+
+    cache = SemanticCache(embed=failing_embed)
+    answers = Answers()
+    assert cache.get_or_answer("C1", "What is the API URL?", answers) == "answer"
+    assert cache.get_or_answer("C1", "What is the API URL?", answers) == "answer"
+    assert answers.calls == 2
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(semantic_cache.time, "time", lambda: now[0])
+    cache = SemanticCache(embed=embed, ttl=60)
+    answers = Answers()
+    cache.get_or_answer("C1", "What is the API URL?", answers)
+    now[0] += 61
+    cache.get_or_answer("C1", "What is the API URL?", answers)
+    assert answers.calls == 2
+
+
+def test_full_scope_evicts_least_recently_used():
+    cache = SemanticCache(embed=embed, maxsize=2)
+    cache.get_or_answer("C1", "What is the API URL?", Answers())
+    cache.get_or_answer("C1", "How do I onboard?", Answers())
+    cache.get_or_answer("C1", "Where is the API URL?", Answers())
+    cache.get_or_answer("C1", "Who owns billing?", Answers())
+
+    answers = Answers()
+    cache.get_or_answer("C1", "What is the API URL?", answers)
+    cache.get_or_answer("C1", "Who owns billing?", answers)
+    assert answers.calls == 0
+    cache.get_or_answer("C1", "How do I onboard?", answers)
+    assert answers.calls == 1
+
+
+def test_scope_limit_is_per_scope():
+    cache = SemanticCache(embed=embed, maxsize=1)
+    cache.get_or_answer("C1", "What is the API URL?", Answers())
+    cache.get_or_answer("C2", "How do I onboard?", Answers())
+
+    answers = Answers()
+    cache.get_or_answer("C1", "What is the API URL?", answers)
+    cache.get_or_answer("C2", "How do I onboard?", answers)
+    assert answers.calls == 0
+
+
+def test_least_recently_used_scope_is_dropped():
+    cache = SemanticCache(embed=embed, max_scopes=1)
+    cache.get_or_answer("C1", "What is the API URL?", Answers())
+    cache.get_or_answer("C2", "What is the API URL?", Answers())
+
+    answers = Answers()
+    cache.get_or_answer("C1", "What is the API URL?", answers)
+    assert answers.calls == 1
+
+
+def test_matrix_grows_past_its_initial_capacity():
+    vectors = {f"q{i}": [float(i == j) for j in range(40)] for i in range(40)}
+    cache = SemanticCache(embed=vectors.__getitem__, maxsize=64)
+    for query in vectors:
+        cache.get_or_answer("C1", query, Answers(query))
+    for query in vectors:
+        assert cache.get_or_answer("C1", query, Answers()) == query
+
+
+@pytest.mark.parametrize("vector", [[3.0, 4.0], [0.0, 0.0]])
+def test_normalize(vector):
+    normalized = semantic_cache.normalize(vector)
+    length = sum(x * x for x in normalized) ** 0.5
+    assert length == pytest.approx(1.0 if any(vector) else 0.0)
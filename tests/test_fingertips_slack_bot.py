@@ -0,0 +1,200 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import pytest
+
+# slack_bot builds its Slack app and Confluence client at import
+os.environ.setdefault("SLACK_BOT_TOKEN", "xoxb-test")
+os.environ.setdefault("SLACK_SIGNING_SECRET", "secret")
+os.environ.setdefault("CONFLUENCE_URL", "https://example.atlassian.net")
+
+from work.fingertips import slack_bot  # noqa: E402
+
+
+def event(text, ts, user="U1", thread_ts="100.0", **fields):
+    return {
+        "event": {
+            "type": "message",
+            "channel": "C1",
+            "user": user,
+            "text": text,
+            "ts": ts,
+            "thread_ts": thread_ts,
+            **fields,
+        }
+    }
+
+
+@pytest.fixture
+def bot(monkeypatch):
+    """Records the queries answered and the messages posted."""
+    calls = {"answered": [], "posted": []}
+
+    def answer_query(user_query, user, channel):
+        calls["answered"].append((user, user_query))
+        return f"answer to {user_query}"
+
+    async def post_message(channel, text, thread_ts):
+        calls["posted"].append(text)
+
+    monkeypatch.setattr(slack_bot, "DEBOUNCE_SECONDS", 0.01)
+    monkeypatch.setattr(slack_bot, "answer_query", answer_query)
+    monkeypatch.setattr(slack_bot, "post_message", post_message)
+    slack_bot.SEEN_MESSAGES.clear()
+    slack_bot.THREAD_HISTORY_CACHE.clear()
+    yield calls
+    assert not slack_bot.pending_queries and not slack_bot.pending_timers
+
+
+async def settle():
+    """Waits out the debounce and every background task it starts."""
+    await asyncio.sleep(slack_bot.DEBOUNCE_SECONDS * 3)
+    while slack_bot.background_tasks:
+        await asyncio.gather(*slack_bot.background_tasks)
+
+
+def test_rapid_messages_are_answered_together(bot):
+    async def scenario():
+        await slack_bot.generate_response(event("first", "101.0"))
+        await slack_bot.generate_response(event("second", "102.0"))
+        await settle()
+
+    asyncio.run(scenario())
+    assert bot["answered"] == [("U1", "first\nsecond")]
+    assert bot["posted"] == ["answer to first\nsecond"]
+
+
+def test_users_are_debounced_separately(bot):
+    async def scenario():
+        await slack_bot.generate_response(event("mine", "101.0", user="U1"))
+        await slack_bot.generate_response(event("theirs", "102.0", user="U2"))
+        await settle()
+
+    asyncio.run(scenario())
+    assert sorted(bot["answered"]) == [("U1", "mine"), ("U2", "theirs")]
+
+
+def test_message_is_queued_once(bot):
+    async def scenario():
+        # A mention in a thread arrives as an app_mention and a message event
+        await slack_bot.generate_response(event("hi <@B1>", "101.0"))
+        await slack_bot.generate_response(event("hi <@B1>", "101.0"))
+        await settle()
+
+    asyncio.run(scenario())
+    assert bot["answered"] == [("U1", "hi <@B1>")]
+
+
+def test_message_after_the_timer_fires_starts_a_new_batch(bot, caplog):
+    async def scenario():
+        await slack_bot.generate_response(event("first", "101.0"))
+        key = next(iter(slack_bot.pending_timers))
+        # The timer fires, and another message arrives before its task has run
+        slack_bot.pending_timers[key].cancel()
+        slack_bot.flush_pending(key)
+        await slack_bot.generate_response(event("second", "102.0"))
+        await settle()
+
+    asyncio.run(scenario())
+    assert bot["answered"] == [("U1", "first"), ("U1", "second")]
+    assert "Background task failed" not in caplog.text
+
+
+class FakeReplies:
+    """Serves a thread's history as conversations.replies pages of page_size."""
+
+    def __init__(self, messages, page_size=200):
+        self.messages = messages
+        self.page_size = page_size
+        self.calls = []
+
+    async def __call__(self, channel, ts, limit, cursor=None):
+        self.calls.append(cursor)
+        start = int(cursor or 0)
+        end = start + self.page_size
+        data = {"messages": self.messages[start:end]}
+        if end < len(self.messages):
+            data["response_metadata"] = {"next_cursor": str(end)}
+        return SimpleNamespace(data=data)
+
+
+@pytest.fixture
+def thread(monkeypatch):
+    """Installs a fake thread history, with the bot as user UBOT / bot B1."""
+
+    def install(messages, page_size=200):
+        replies = FakeReplies(messages, page_size)
+        monkeypatch.setattr(
+            slack_bot.slack_app.client, "conversations_replies", replies
+        )
+        return replies
+
+    slack_bot.THREAD_HISTORY_CACHE.clear()
+    slack_bot.MY_INFO_CACHE.clear()
+    slack_bot.MY_INFO_CACHE[slack_bot.slack_app.client.token] = {
+        "bot_id": "B1",
+        "user": "UBOT",
+    }
+    return install
+
+
+ROOT = {"ts": "100.0", "user": "U1", "text": "anyone?"}
+BOT_REPLY = {"ts": "101.0", "bot_id": "B1", "text": "the answer"}
+
+
+def speaking_to_me(body):
+    return asyncio.run(slack_bot.speaking_to_me(body))
+
+
+def test_reply_after_the_bot_is_for_me(thread):
+    reply = event("thanks, and?", "102.0")
+    thread([ROOT, BOT_REPLY, reply["event"]])
+    assert speaking_to_me(reply)
+
+
+def test_bot_message_that_is_newest_is_not_for_me(thread):
+    own = {"event": {**BOT_REPLY, "channel": "C1", "thread_ts": "100.0"}}
+    thread([ROOT, BOT_REPLY])
+    assert not speaking_to_me(own)
+
+
+def test_thread_without_the_bot_is_not_for_me(thread):
+    reply = event("me neither", "102.0")
+    thread([ROOT, {"ts": "101.0", "user": "U2", "text": "no idea"}, reply["event"]])
+    assert not speaking_to_me(reply)
+
+
+def test_earlier_mention_is_for_me(thread):
+    mention = {"ts": "101.0", "user": "U2", "text": "ask <@UBOT>"}
+    reply = event("so?", "102.0")
+    thread([ROOT, mention, reply["event"]])
+    assert speaking_to_me(reply)
+
+
+def test_cached_history_is_extended_with_the_new_message(thread):
+    first = event("thanks", "102.0")
+    replies = thread([ROOT, BOT_REPLY, first["event"]])
+    assert speaking_to_me(first)
+    # The cached history ends with "thanks", so without the new message appended
+    # the scan would decide on it instead
+    own = {"event": {**BOT_REPLY, "ts": "103.0", "channel": "C1", "thread_ts": "100.0"}}
+    assert not speaking_to_me(own)
+    assert speaking_to_me(event("one more", "104.0"))
+    assert len(replies.calls) == 1
+
+
+def test_every_page_of_the_thread_is_read(thread):
+    reply = event("and then?", "104.0")
+    replies = thread(
+        [
+            ROOT,
+            {"ts": "101.0", "user": "U2", "text": "no idea"},
+            BOT_REPLY | {"ts": "102.0"},
+            {"ts": "103.0", "user": "U2", "text": "hmm"},
+            reply["event"],
+        ],
+        page_size=2,
+    )
+    assert speaking_to_me(reply)
+    assert replies.calls == [None, "2", "4"]
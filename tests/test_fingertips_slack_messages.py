@@ -0,0 +1,27 @@
+from work.fingertips.slack_messages import split_message
+
+
+def test_split_message_empty_text():
+    assert split_message("", 10) == [""]
+
+
+def test_split_message_short_text_is_one_message():
+    assert split_message("one\n\ntwo", 10) == ["one\n\ntwo"]
+
+
+def test_split_message_breaks_between_paragraphs():
+    # "aaaa\n\nbbbb" is exactly the limit, adding "cccc" would exceed it
+    assert split_message("aaaa\n\nbbbb\n\ncccc", 10) == ["aaaa\n\nbbbb", "cccc"]
+
+
+def test_split_message_cuts_oversized_paragraph():
+    chunks = split_message("ab\n\n" + "z" * 25 + "\n\nyy", 10)
+    assert chunks == ["ab", "z" * 10, "z" * 10, "zzzzz\n\nyy"]
+    assert all(len(chunk) <= 10 for chunk in chunks)
+
+
+def test_split_message_keeps_all_text():
+    text = "\n\n".join(f"paragraph {i} " * (i + 1) for i in range(20))
+    chunks = split_message(text, 50)
+    assert all(len(chunk) <= 50 for chunk in chunks)
+    assert "".join(chunks).replace("\n", "") == text.replace("\n", "")
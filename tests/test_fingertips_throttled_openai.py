@@ -0,0 +1,66 @@
+import pytest
+
+from work.fingertips.confluence.clients import throttled_openai
+from work.fingertips.confluence.clients.throttled_openai import RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(throttled_openai.time, "monotonic", fake)
+    return fake
+
+
+def test_requests_wait_for_refill(clock):
+    limiter = RateLimiter(max_requests_per_minute=60, max_tokens_per_minute=6000)
+    for _ in range(60):
+        assert limiter._try_acquire(0) == 0
+    # One request per second refills, so the next one waits a full second
+    assert limiter._try_acquire(0) == pytest.approx(1.0)
+
+    clock.now += 0.5
+    assert limiter._try_acquire(0) == pytest.approx(0.5)
+    clock.now += 0.5
+    assert limiter._try_acquire(0) == 0
+
+
+def test_tokens_wait_for_refill(clock):
+    limiter = RateLimiter(max_requests_per_minute=1000, max_tokens_per_minute=600)
+    assert limiter._try_acquire(600) == 0
+    # 10 tokens per second refill, so 100 tokens take 10 seconds
+    assert limiter._try_acquire(100) == pytest.approx(10.0)
+
+    clock.now += 30
+    assert limiter._try_acquire(300) == 0
+    assert limiter._try_acquire(1) == pytest.approx(0.1)
+
+
+def test_refill_is_capped_at_the_per_minute_limits(clock):
+    limiter = RateLimiter(max_requests_per_minute=60, max_tokens_per_minute=600)
+    clock.now += 3600
+    assert limiter._try_acquire(0) == 0
+    assert limiter.available_request_capacity == pytest.approx(59)
+    assert limiter.available_token_capacity == pytest.approx(600)
+
+
+def test_oversized_request_is_clamped_to_the_token_limit(clock):
+    limiter = RateLimiter(max_requests_per_minute=60, max_tokens_per_minute=600)
+    # More tokens than a full minute's budget would otherwise never be granted
+    assert limiter._try_acquire(10_000) == 0
+    assert limiter.available_token_capacity == pytest.approx(0)
+
+
+def test_failed_acquire_takes_no_capacity(clock):
+    limiter = RateLimiter(max_requests_per_minute=60, max_tokens_per_minute=600)
+    assert limiter._try_acquire(500) == 0
+    assert limiter._try_acquire(200) > 0
+    assert limiter.available_request_capacity == pytest.approx(59)
+    assert limiter.available_token_capacity == pytest.approx(100)
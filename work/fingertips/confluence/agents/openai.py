@@ -3,15 +3,19 @@ import json
 import logging
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional
 
-from openai import OpenAI
+from jinja2 import Environment, FileSystemLoader
+from openai.lib.streaming import AssistantStreamManager
 from openai.types.beta.assistant import Assistant
 from openai.types.beta.thread import Thread
-from openai.types.beta.threads import ThreadMessage
+from openai.types.beta.threads import Message
 from openai.types.beta.threads.run import Run
 
+from work.fingertips.confluence.clients.throttled_openai import RateLimitedOpenAIClient
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)  # Set global logging level to DEBUG
 
@@ -32,16 +36,89 @@ stderr_handler.setFormatter(formatter)
 
 logger.info("Initialized Confluence API and Slack App")
 
+RUN_END_EVENTS = (
+    "thread.run.completed",
+    "thread.run.incomplete",
+    "thread.run.failed",
+    "thread.run.cancelled",
+    "thread.run.expired",
+)
+
+# The assistant prompt never changes, so compile and render it once per process
+_JINJA_ENV = Environment(
+    loader=FileSystemLoader(Path(__file__).resolve().parents[2] / "prompts"),
+    auto_reload=False,
+    cache_size=-1,
+)
+ASSISTANT_INSTRUCTIONS = _JINJA_ENV.get_template("fingertips/prompt.j2").render()
+
+ASSISTANT_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "search_confluence",
+            "description": "Searches Confluence using the Confluence Query Language (CQL). Returns max 5 results.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "cql_query": {
+                        "type": "string",
+                        "description": "The Confluence Query Language (CQL) query to search Confluence",
+                    },
+                },
+                "required": ["cql_query"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "load_confluence_page",
+            "description": "Loads a Confluence page using the Confluence REST API",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "page_or_content_id": {
+                        "type": "string",
+                        "description": "The Confluence page or content ID to load, e.g. from result['content']['id']",
+                    },
+                },
+                "required": ["page_or_content_id"],
+            },
+        },
+    },
+]
+
+JSON_TYPES = {
+    int: "integer",
+    float: "number",
+    bool: "boolean",
+    str: "string",
+    list: "array",
+    dict: "object",
+}
+
+# Tool calls are Confluence HTTP requests, so they run on a shared I/O pool
+_TOOL_POOL = ThreadPoolExecutor(max_workers=8)
+
+
+class RunError(RuntimeError):
+    """
+    An assistant run ended without completing, so it has no answer to return.
+    """
+
 
 class OpenAIAgent:
-    def __init__(self, confluence_manager: object, tools=Optional[list[callable]]):
-        self._openai_client = OpenAI()
+    def __init__(
+        self, confluence_manager: object, tools: Optional[List[Callable]] = None
+    ):
+        self._openai_client = RateLimitedOpenAIClient()
         self._assistant = None
         self._threads: Dict[str, Thread] = {}
         self._confluence_manager = confluence_manager
-        self._tools = tools
+        self._tools = tools or []
 
-    def create_message(self, thread_id: str, content: str) -> ThreadMessage:
+    def create_message(self, thread_id: str, content: str) -> Message:
         """
         Send a message in the OpenAI thread.
         """
@@ -49,30 +126,11 @@ class OpenAIAgent:
             thread_id=thread_id, role="user", content=content
         )
 
-    def get_tools_config(self):
-        """
-        Get the tools config.
-        """
-        tools_config = []
-        for tool in self._tools:
-            tools_config.append(
-                {
-                    "type": "function",
-                    "function": {
-                        "name": tool.__name__,
-                        "description": tool.__doc__,
-                        "parameters": self.generate_json_schema(tool),
-                    },
-                }
-            )
-        return tools_config
-
+    @staticmethod
     def get_tool_parameters(tool: callable):
         """
         Inspect tool and get its parameters. For each parameter, find the json schema representation
         """
-        import inspect
-
         params = inspect.signature(tool).parameters
         tool_params = {}
         for name, param in params.items():
@@ -84,29 +142,18 @@ class OpenAIAgent:
             }
         return tool_params
 
-    def type_to_json_type(self, type_hint):
+    @staticmethod
+    def type_to_json_type(type_hint):
         """
         Convert a Python type hint to a JSON schema type.
 
         :param type_hint: The Python type hint.
         :return: A string representing the JSON schema type.
         """
-        if type_hint is int:
-            return "integer"
-        elif type_hint is float:
-            return "number"
-        elif type_hint is bool:
-            return "boolean"
-        elif type_hint is str:
-            return "string"
-        elif type_hint is list:
-            return "array"
-        elif type_hint is dict:
-            return "object"
-        else:
-            return "string"  # Default or unknown types
-
-    def generate_json_schema(self, callable_to_inspect: callable):
+        return JSON_TYPES.get(type_hint, "string")  # Default or unknown types
+
+    @staticmethod
+    def generate_json_schema(callable_to_inspect: callable):
         """
         Generate a JSON schema for the parameters of a callable (function/method).
         This version infers types from type annotations.
@@ -117,7 +164,7 @@ class OpenAIAgent:
         for param_name, param in signature.parameters.items():
             # Infer type from annotation, default to "string" if not provided
             type_hint = (
-                self.type_to_json_type(param.annotation)
+                OpenAIAgent.type_to_json_type(param.annotation)
                 if param.annotation is not inspect.Parameter.empty
                 else "string"
             )
@@ -139,53 +186,13 @@ class OpenAIAgent:
         Get the OpenAI assistant.
         """
         if self._assistant is None:
-            from jinja2 import Environment, FileSystemLoader
-
-            env = Environment(
-                loader=FileSystemLoader(Path.cwd() / "work/fingertips/prompts")
-            )
-            template = env.get_template("fingertips/prompt.j2")
-            instructions = template.render()
             self._assistant = self._openai_client.beta.assistants.create(
-                instructions=instructions,
+                instructions=ASSISTANT_INSTRUCTIONS,
                 name="Fingertip Search Assistant",
                 model=os.getenv("OPENAI_MODEL"),
-                tools=[
-                    {
-                        "type": "function",
-                        "function": {
-                            "name": "search_confluence",
-                            "description": "Searches Confluence using the Confluence Query Language (CQL). Returns max 5 results.",
-                            "parameters": {
-                                "type": "object",
-                                "properties": {
-                                    "cql_query": {
-                                        "type": "string",
-                                        "description": "The Confluence Query Language (CQL) query to search Confluence",
-                                    },
-                                },
-                                "required": ["cql_query"],
-                            },
-                        },
-                    },
-                    {
-                        "type": "function",
-                        "function": {
-                            "name": "load_confluence_page",
-                            "description": "Loads a Confluence page using the Confluence REST API",
-                            "parameters": {
-                                "type": "object",
-                                "properties": {
-                                    "page_or_content_id": {
-                                        "type": "string",
-                                        "description": "The Confluence page or content ID to load, e.g. from result['content']['id']",
-                                    },
-                                },
-                                "required": ["page_or_content_id"],
-                            },
-                        },
-                    },
-                ],
+                # Hand-written rather than derived from the tools' signatures, which
+                # cannot carry the per-parameter descriptions the model relies on
+                tools=ASSISTANT_TOOLS,
             )
         return self._assistant
 
@@ -197,114 +204,126 @@ class OpenAIAgent:
             self._threads[thread_key] = self._openai_client.beta.threads.create()
         return self._threads[thread_key]
 
+    def forget_openai_thread(self, thread_key: str) -> None:
+        """
+        Drop the OpenAI thread for the thread key and delete it on the server.
+        """
+        thread = self._threads.pop(thread_key, None)
+        if thread is None:
+            return
+        try:
+            self._openai_client.beta.threads.delete(thread.id)
+        except Exception as e:
+            logger.warning(f"Failed to delete thread {thread.id}: {e}")
+
     def send_message(self, message: str, thread_key: str) -> List[Dict[str, Any]]:
         """
-        Send a message to OpenAI and await the responses.
+        Send a message to OpenAI and await the responses. Raises RunError if the
+        run fails, expires, is cancelled or is left incomplete.
         """
         thread = self.get_openai_thread(thread_key)
         message = self.create_message(thread.id, message)
-        run = self.create_run(thread.id)
-        run = self.wait_for_run(thread.id, run.id)
-        messages = self.get_thread_messages(thread.id)
-        relevant_messages = self.extract_relevant_messages(messages, message.id)
-        return relevant_messages
-
-    def create_run(self, thread_id: str) -> Run:
+        run = self.stream_run(thread.id)
+        if run is None or run.status != "completed":
+            status = run.status if run is not None else "unknown"
+            last_error = run.last_error if run is not None else None
+            raise RunError(f"Run on thread {thread.id} ended {status}: {last_error}")
+        return self.get_thread_messages(thread.id, message.id)
+
+    def stream_run(self, thread_id: str) -> Optional[Run]:
         """
-        Create a run in the OpenAI thread.
+        Run the assistant on the OpenAI thread over a single event stream, submitting
+        tool outputs whenever the run requires action. Returns the finished run.
         """
-        return self._openai_client.beta.threads.runs.create(
+        stream = self._openai_client.beta.threads.runs.stream(
             thread_id=thread_id, assistant_id=self.assistant.id
         )
+        while True:
+            with stream as events:
+                for event in events:
+                    if event.event in RUN_END_EVENTS:
+                        return event.data
+                    if event.event == "thread.run.requires_action":
+                        run = event.data
+                        break
+                else:
+                    logger.warning("Run stream ended before the run finished")
+                    return None
+
+            # The run pauses on requires_action; submitting continues it on a new stream
+            tool_calls = run.required_action.submit_tool_outputs.tool_calls
+            stream = self.handle_submit_tool_outputs(tool_calls, thread_id, run.id)
 
-    def wait_for_run(self, thread_id: str, run_id: str) -> Run:
+    def handle_submit_tool_outputs(
+        self, tool_calls: Any, thread_id: str, run_id: str
+    ) -> AssistantStreamManager:
         """
-        Wait for the run to complete or enter requires_action in the OpenAI thread.
+        Run every requested tool call concurrently and submit all outputs at once.
         """
-        run = self._openai_client.beta.threads.runs.retrieve(
-            thread_id=thread_id, run_id=run_id
+        outputs = _TOOL_POOL.map(self.run_tool_call, tool_calls)
+        tool_outputs = [
+            {"tool_call_id": tool_call.id, "output": output}
+            for tool_call, output in zip(tool_calls, outputs)
+        ]
+        return self.submit_tool_outputs(
+            thread_id=thread_id, run_id=run_id, tool_outputs=tool_outputs
         )
-        while run.status not in ["completed", "requires_action"]:
-            run = self._openai_client.beta.threads.runs.retrieve(
-                thread_id=thread_id, run_id=run_id
-            )
 
-        if run.status == "completed":
-            return run
+    def run_tool_call(self, tool_call: Any) -> str:
+        """
+        Execute a single tool call and return its output as a string. Failures are
+        returned as an error output: every call needs an output, or the run waits
+        until it expires.
+        """
+        try:
+            return self.execute_tool_call(tool_call)
+        except Exception as e:
+            logger.error(f"Tool call {tool_call.function.name} failed: {e}")
+            return json.dumps({"error": f"{type(e).__name__}: {e}"})
 
-        if (
-            run.status == "requires_action"
-            and run.required_action.type == "submit_tool_outputs"
-        ):
-            tool_calls = run.required_action.submit_tool_outputs.tool_calls
-            self.handle_submit_tool_outputs(tool_calls, thread_id, run_id)
-            run = self.wait_for_run(thread_id, run_id)
-        return run
+    def execute_tool_call(self, tool_call: Any) -> str:
+        """
+        Execute a single tool call, raising if the arguments or the tool fail.
+        """
+        arguments = json.loads(tool_call.function.arguments)
+        if tool_call.function.name == "search_confluence":
+            cql_query = arguments.get("cql_query")
+            logger.info(f"Searching Confluence with CQL query: {cql_query}")
+            results = self._confluence_manager.search_confluence(cql_query)
+            result_count = results.get("size", 0)
+            results = json.dumps(results)
+            logger.info(f"Found {result_count} results: {results}")
+            return results
+        if tool_call.function.name == "load_confluence_page":
+            page_or_content_id = arguments.get("page_or_content_id")
+            logger.info(
+                f"Loading Confluence page or content with ID: {page_or_content_id}"
+            )
+            return json.dumps(
+                self._confluence_manager.load_confluence_page(page_or_content_id)
+            )
 
-    def handle_submit_tool_outputs(
-        self, tool_calls: Any, thread_id: str, run_id: str
-    ) -> Run:
-        for tool_call in tool_calls:
-            results = None
-            if tool_call.function.name == "search_confluence":
-                arguments = json.loads(tool_call.function.arguments)
-                cql_query = arguments.get("cql_query")
-                logger.info(f"Searching Confluence with CQL query: {cql_query}")
-                results = self._confluence_manager.search_confluence(cql_query)
-                result_count = results.get("size", 0)
-                results = json.dumps(results)
-                logger.info(f"Found {result_count} results: {results}")
-            if tool_call.function.name == "load_confluence_page":
-                arguments = json.loads(tool_call.function.arguments)
-                page_or_content_id = arguments.get("page_or_content_id")
-                logger.info(
-                    f"Loading Confluence page or content with ID: {page_or_content_id}"
-                )
-                results = json.dumps(
-                    self._confluence_manager.load_confluence_page(page_or_content_id)
-                )
-
-            if results is not None:
-                return self.submit_search_confluence_tool_outputs(
-                    thread_id=thread_id,
-                    run_id=run_id,
-                    tool_call_id=tool_call.id,
-                    results=results,
-                )
-
-    def submit_search_confluence_tool_outputs(
+        logger.warning(f"Unknown tool requested: {tool_call.function.name}")
+        return json.dumps({"error": f"Unknown tool: {tool_call.function.name}"})
+
+    def submit_tool_outputs(
         self,
         thread_id: str,
         run_id: str,
-        tool_call_id: str,
-        results: str,
-    ) -> Run:
-        return self._openai_client.beta.threads.runs.submit_tool_outputs(
+        tool_outputs: List[Dict[str, str]],
+    ) -> AssistantStreamManager:
+        return self._openai_client.beta.threads.runs.submit_tool_outputs_stream(
             thread_id=thread_id,
             run_id=run_id,
-            tool_outputs=[
-                {
-                    "tool_call_id": tool_call_id,
-                    "output": results,
-                },
-            ],
+            tool_outputs=tool_outputs,
         )
 
-    def get_thread_messages(self, thread_id: str) -> List[ThreadMessage]:
+    def get_thread_messages(self, thread_id: str, message_id: str) -> List[Message]:
         """
-        Get all messages from the OpenAI thread.
+        Get the messages added to the OpenAI thread after message_id, oldest first.
         """
-        return self._openai_client.beta.threads.messages.list(thread_id=thread_id)
-
-    def extract_relevant_messages(
-        self, messages: List[ThreadMessage], message_id: str
-    ) -> List[ThreadMessage]:
-        """
-        Extract relevant messages from the OpenAI thread.
-        """
-        relevant_messages = []
-        for msg in messages:
-            if msg.id == message_id:
-                break
-            relevant_messages.append(msg)
-        return relevant_messages
+        return list(
+            self._openai_client.beta.threads.messages.list(
+                thread_id=thread_id, after=message_id, order="asc"
+            )
+        )
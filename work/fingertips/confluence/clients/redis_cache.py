@@ -0,0 +1,113 @@
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+try:
+    import redis
+except ImportError:  # redis is optional, caches are then per process
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL")
+REDIS_KEY_PREFIX = os.getenv("REDIS_KEY_PREFIX", "fingertips:")
+
+
+class RedisCache:
+    """
+    JSON values in Redis, shared by every worker process. It backs the in-process
+    caches as a second tier: callers check their own cache first and only come
+    here on a miss. Redis errors are logged and treated as misses, so an outage
+    costs hit rate rather than requests.
+    """
+
+    def __init__(self, url: str, prefix: str = REDIS_KEY_PREFIX):
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def get(self, key: str) -> Any:
+        """Returns the value stored under key, or None."""
+        try:
+            value = self._client.get(self._prefix + key)
+        except redis.RedisError as e:
+            logger.warning("Redis get failed: %s", e)
+            return None
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, value: Any, ttl: int) -> None:
+        """Stores value under key for ttl seconds."""
+        try:
+            self._client.setex(self._prefix + key, ttl, json.dumps(value))
+        except redis.RedisError as e:
+            logger.warning("Redis set failed: %s", e)
+
+    def delete(self, key: str) -> None:
+        try:
+            self._client.delete(self._prefix + key)
+        except redis.RedisError as e:
+            logger.warning("Redis delete failed: %s", e)
+
+    def index_add(
+        self, index: str, member: str, value: Any, ttl: int, maxsize: int
+    ) -> None:
+        """
+        Stores value under its own key for ttl seconds and records member in index,
+        a sorted set scored by write time. Members older than ttl are dropped from
+        the index, as are all but the newest maxsize.
+        """
+        now = time.time()
+        index_key = self._prefix + index
+        try:
+            with self._client.pipeline() as pipe:
+                pipe.setex(f"{index_key}:{member}", ttl, json.dumps(value))
+                pipe.zadd(index_key, {member: now})
+                pipe.zremrangebyscore(index_key, "-inf", now - ttl)
+                pipe.zremrangebyrank(index_key, 0, -maxsize - 1)
+                pipe.expire(index_key, ttl)
+                pipe.execute()
+        except redis.RedisError as e:
+            logger.warning("Redis index add failed: %s", e)
+
+    def index_members(self, index: str, ttl: int) -> List[str]:
+        """Returns the members of index written in the last ttl seconds."""
+        try:
+            members = self._client.zrangebyscore(
+                self._prefix + index, time.time() - ttl, "+inf"
+            )
+        except redis.RedisError as e:
+            logger.warning("Redis index read failed: %s", e)
+            return []
+        return [member.decode() for member in members]
+
+    def index_get(self, index: str, members: List[str]) -> Dict[str, Any]:
+        """Returns the values of the given members of index that have not expired."""
+        if not members:
+            return {}
+        index_key = self._prefix + index
+        try:
+            values = self._client.mget([f"{index_key}:{m}" for m in members])
+        except redis.RedisError as e:
+            logger.warning("Redis mget failed: %s", e)
+            return {}
+        return {
+            member: json.loads(value)
+            for member, value in zip(members, values)
+            if value is not None
+        }
+
+
+def get_shared_cache(url: Optional[str] = REDIS_URL) -> Optional[RedisCache]:
+    """Returns a RedisCache when REDIS_URL is set and redis is installed, else None."""
+    if not url:
+        return None
+    if redis is None:
+        logger.warning(
+            "REDIS_URL is set but redis is not installed; caching per process"
+        )
+        return None
+    return RedisCache(url)
+
+
+shared_cache = get_shared_cache()
@@ -0,0 +1,232 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from cachetools import LRUCache
+
+from work.fingertips.confluence.clients.redis_cache import RedisCache
+from work.fingertips.confluence.clients.throttled_openai import RateLimitedOpenAIClient
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "1024"))
+SEMANTIC_CACHE_SCOPES = int(os.getenv("SEMANTIC_CACHE_SCOPES", "64"))
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", "86400"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+
+
+def normalize(vector: List[float]) -> np.ndarray:
+    """Scales vector to unit length, so cosine similarity is a dot product."""
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm else array
+
+
+class ScopeEntries:
+    """
+    One scope's cached answers. Embeddings are rows of a single matrix, so a
+    lookup is one matrix-vector product. Rows are written in place and never
+    move, and at most `maxsize` are kept: when full, a row older than `ttl`
+    seconds or else the least recently used one is overwritten.
+    """
+
+    def __init__(self, maxsize: int, ttl: int):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.matrix: Optional[np.ndarray] = None
+        self.stored_at = np.empty(0)
+        self.used_at = np.empty(0)
+        self.digests: List[str] = []
+        self.responses: List[str] = []
+        self.rows: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.digests)
+
+    def free_row(self, dim: int) -> int:
+        """Returns the row to write a new entry to, growing the matrix if needed."""
+        count = len(self.digests)
+        if count < self.maxsize:
+            if self.matrix is None or count == len(self.matrix):
+                capacity = min(self.maxsize, max(16, 2 * count))
+                matrix = np.zeros((capacity, dim), dtype=np.float32)
+                stored_at = np.zeros(capacity)
+                used_at = np.zeros(capacity)
+                if self.matrix is not None:
+                    matrix[:count] = self.matrix
+                    stored_at[:count] = self.stored_at
+                    used_at[:count] = self.used_at
+                self.matrix, self.stored_at, self.used_at = matrix, stored_at, used_at
+            self.digests.append("")
+            self.responses.append("")
+            return count
+        expired = self.stored_at[:count] < time.time() - self.ttl
+        row = int(np.argmin(np.where(expired, -np.inf, self.used_at[:count])))
+        del self.rows[self.digests[row]]
+        return row
+
+    def store(
+        self, digest: str, embedding: np.ndarray, response: str, stored_at: float
+    ) -> None:
+        row = self.rows.get(digest)
+        if row is None:
+            row = self.free_row(len(embedding))
+            self.rows[digest] = row
+            self.digests[row] = digest
+        self.matrix[row] = embedding
+        self.responses[row] = response
+        self.stored_at[row] = stored_at
+        self.used_at[row] = time.monotonic()
+
+
+class SemanticCache:
+    """
+    Caches answers by the meaning of the question rather than its exact text: a
+    query whose embedding is within `threshold` cosine similarity of a cached one
+    reuses its answer. Entries are scoped (e.g. per Slack channel) so an answer is
+    never served outside the conversation it was given in. Each scope keeps at
+    most `maxsize` answers, LRU-first, for `ttl` seconds after they were stored,
+    and only the `max_scopes` most recently used scopes are kept. With a `shared`
+    Redis cache, answers are also stored there, so every worker can serve what
+    any one of them has answered; Redis is only read when this worker's own
+    memory has no match.
+    """
+
+    def __init__(
+        self,
+        embed: Optional[Callable[[str], List[float]]] = None,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        maxsize: int = SEMANTIC_CACHE_SIZE,
+        ttl: int = SEMANTIC_CACHE_TTL,
+        shared: Optional[RedisCache] = None,
+        max_scopes: int = SEMANTIC_CACHE_SCOPES,
+    ):
+        self._embed = embed or self.embed
+        self._openai_client = None
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._shared = shared
+        self._scopes: LRUCache = LRUCache(maxsize=max_scopes)
+        # Guards _scopes and the entries in it, but not the similarity search
+        self._lock = threading.Lock()
+
+    def embed(self, text: str) -> List[float]:
+        """Embeds text with the OpenAI embeddings API."""
+        if self._openai_client is None:
+            self._openai_client = RateLimitedOpenAIClient()
+        response = self._openai_client.embeddings.create(
+            model=EMBEDDING_MODEL, input=text
+        )
+        return response.data[0].embedding
+
+    @staticmethod
+    def digest(query: str) -> str:
+        return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+    def entries(self, scope: str) -> ScopeEntries:
+        """Returns the scope's entries, creating them if needed. Call with the lock held."""
+        entries = self._scopes.get(scope)
+        if entries is None:
+            entries = self._scopes[scope] = ScopeEntries(self.maxsize, self.ttl)
+        return entries
+
+    def load_shared(self, scope: str) -> None:
+        """Copies the scope's answers that other workers stored in Redis into memory."""
+        with self._lock:
+            entries = self.entries(scope)
+            known = set(entries.rows)
+        index = f"answers:{scope}"
+        missing = [
+            digest
+            for digest in self._shared.index_members(index, self.ttl)
+            if digest not in known
+        ]
+        shared_entries = self._shared.index_get(index, missing)
+        with self._lock:
+            for digest, (embedding, response, stored_at) in shared_entries.items():
+                entries.store(digest, normalize(embedding), response, stored_at)
+
+    def lookup(self, scope: str, embedding: np.ndarray) -> Optional[str]:
+        """Returns the answer of the most similar cached query in scope, if close enough."""
+        with self._lock:
+            entries = self._scopes.get(scope)
+            if not entries:
+                return None
+            count = len(entries)
+            # Rows are only overwritten on eviction, which also changes their digest,
+            # so the digests snapshot tells whether the best row is still the same entry
+            digests = list(entries.digests)
+            matrix = entries.matrix[:count]
+            stored_at = entries.stored_at[:count].copy()
+
+        similarities = matrix @ embedding
+        # Entries copied from Redis keep their original time, so age is checked here
+        similarities[stored_at < time.time() - self.ttl] = -np.inf
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            return None
+
+        with self._lock:
+            row = entries.rows.get(digests[best])
+            if row is None:
+                return None
+            entries.used_at[row] = time.monotonic()
+            return entries.responses[row]
+
+    def get_or_answer(self, scope: str, query: str, answer: Callable[[], str]) -> str:
+        """
+        Returns a cached answer for a similar query, or calls answer() and caches
+        it. Empty answers are not cached, and if the query cannot be embedded the
+        cache is bypassed rather than failing the answer.
+        """
+        try:
+            embedding = normalize(self._embed(query))
+        except Exception as e:
+            logger.warning("Embedding failed, answering without the cache: %s", e)
+            return answer()
+        cached = self.lookup(scope, embedding)
+        if cached is None and self._shared is not None:
+            # Only a miss in this worker's memory pays for the Redis round-trip
+            self.load_shared(scope)
+            cached = self.lookup(scope, embedding)
+        if cached is not None:
+            return cached
+
+        response = answer()
+        if not response:
+            return response
+        stored_at = time.time()
+        digest = self.digest(query)
+        with self._lock:
+            self.entries(scope).store(digest, embedding, response, stored_at)
+        if self._shared is not None:
+            self._shared.index_add(
+                f"answers:{scope}",
+                digest,
+                (embedding.tolist(), response, stored_at),
+                self.ttl,
+                self.maxsize,
+            )
+        return response
+
+    def invalidate(self, scope: Optional[str] = None) -> None:
+        """
+        Drops the cached answers for scope, or every answer if scope is None. A
+        scoped invalidation also deletes the scope from Redis, so no worker loads
+        those answers from it again, but other workers keep serving the copies
+        already in their memory until they expire. Only this worker's memory is
+        cleared.
+        """
+        if scope is not None and self._shared is not None:
+            self._shared.delete(f"answers:{scope}")
+        with self._lock:
+            if scope is None:
+                self._scopes.clear()
+            else:
+                self._scopes.pop(scope, None)
@@ -0,0 +1,118 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Any
+
+from openai import OpenAI
+
+MAX_REQUESTS_PER_MINUTE = float(os.getenv("OPENAI_MAX_REQUESTS_PER_MINUTE", "500"))
+MAX_TOKENS_PER_MINUTE = float(os.getenv("OPENAI_MAX_TOKENS_PER_MINUTE", "90000"))
+
+
+def estimate_tokens(text: Any) -> int:
+    """Cheap token estimate (~4 characters per token)."""
+    return len(str(text)) // 4
+
+
+class RateLimiter:
+    """
+    Request and token buckets shared by every OpenAI caller, refilled continuously
+    at rpm/60 and tpm/60 per second, as in the OpenAI cookbook's
+    api_request_parallel_processor. Callers wait for capacity up front instead of
+    burning a round trip on a 429.
+    """
+
+    def __init__(self, max_requests_per_minute: float, max_tokens_per_minute: float):
+        self.max_requests_per_minute = max_requests_per_minute
+        self.max_tokens_per_minute = max_tokens_per_minute
+        self.available_request_capacity = max_requests_per_minute
+        self.available_token_capacity = max_tokens_per_minute
+        self._last_update_time = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _try_acquire(self, tokens: int) -> float:
+        """
+        Take capacity for one request of `tokens` tokens. Returns 0 on success,
+        otherwise the number of seconds to wait before trying again.
+        """
+        tokens = min(tokens, self.max_tokens_per_minute)
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._last_update_time
+            self._last_update_time = now
+            self.available_request_capacity = min(
+                self.available_request_capacity
+                + self.max_requests_per_minute * elapsed / 60.0,
+                self.max_requests_per_minute,
+            )
+            self.available_token_capacity = min(
+                self.available_token_capacity
+                + self.max_tokens_per_minute * elapsed / 60.0,
+                self.max_tokens_per_minute,
+            )
+
+            if (
+                self.available_request_capacity >= 1
+                and self.available_token_capacity >= tokens
+            ):
+                self.available_request_capacity -= 1
+                self.available_token_capacity -= tokens
+                return 0.0
+
+            request_wait = (
+                (1 - self.available_request_capacity)
+                * 60.0
+                / self.max_requests_per_minute
+            )
+            token_wait = (
+                (tokens - self.available_token_capacity)
+                * 60.0
+                / self.max_tokens_per_minute
+            )
+            return max(request_wait, token_wait, 0.001)
+
+    def acquire(self, tokens: int = 0) -> None:
+        """Block until there is capacity for one request of `tokens` tokens."""
+        while delay := self._try_acquire(tokens):
+            time.sleep(delay)
+
+    async def acquire_async(self, tokens: int = 0) -> None:
+        """Wait, without blocking the event loop, for capacity for one request."""
+        while delay := self._try_acquire(tokens):
+            await asyncio.sleep(delay)
+
+
+rate_limiter = RateLimiter(MAX_REQUESTS_PER_MINUTE, MAX_TOKENS_PER_MINUTE)
+
+
+class _ThrottledResource:
+    """
+    Proxies an OpenAI client resource (e.g. `client.beta.threads.runs`), taking
+    capacity from the rate limiter before every API method call.
+    """
+
+    def __init__(self, resource: Any, limiter: RateLimiter):
+        self._resource = resource
+        self._limiter = limiter
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._resource, name)
+        if callable(attr):
+
+            def throttled_call(*args, **kwargs):
+                self._limiter.acquire(estimate_tokens(args) + estimate_tokens(kwargs))
+                return attr(*args, **kwargs)
+
+            return throttled_call
+        return _ThrottledResource(attr, self._limiter)
+
+
+class RateLimitedOpenAIClient(_ThrottledResource):
+    """
+    Drop-in replacement for `openai.OpenAI` that paces every call through the
+    shared rate limiter.
+    """
+
+    def __init__(self, limiter: RateLimiter = rate_limiter, **client_kwargs):
+        super().__init__(OpenAI(**client_kwargs), limiter)
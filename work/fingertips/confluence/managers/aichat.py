@@ -1,30 +1,165 @@
+import asyncio
+import atexit
+import functools
+import hashlib
+import json
 import logging
 import os
-import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
 from pathlib import Path
-from typing import List, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
 
-from atlassian import Confluence
+from openai import OpenAI
 from pydantic import BaseModel
-from simpleaichat import AIChat
+from simpleaichat import AsyncAIChat
 
-CONTEXT_LIMIT = os.getenv("OPENAI_MODEL_CONTEXT_LIMIT", 100000)
-OPENAI_MODEL = os.getenv("OPENAI_MODEL", 100000)
+from work.fingertips.confluence.agents.openai import RunError
+from work.fingertips.confluence.clients.throttled_openai import (
+    estimate_tokens,
+    rate_limiter,
+)
+from work.fingertips.confluence.managers.openai import OpenAIManager
+
+CONTEXT_LIMIT = int(os.getenv("OPENAI_MODEL_CONTEXT_LIMIT", "100000"))
+OPENAI_MODEL = os.getenv("OPENAI_MODEL")
+MAX_CONCURRENCY = int(os.getenv("FINGERTIPS_MAX_CONCURRENCY", "5"))
+CHUNK_GROUP_SIZE = int(os.getenv("FINGERTIPS_CHUNK_GROUP_SIZE", "8"))
+# Completion budget for one chunk's answer; a group gets this much per chunk
+CHUNK_ANSWER_MAX_TOKENS = 1000
+BATCH_POLL_INITIAL_DELAY = 5.0
+BATCH_POLL_MAX_DELAY = 60.0
 
 logger = logging.getLogger(__name__)
 
+try:
+    import diskcache
+except ImportError:  # diskcache is optional, answers are then cached per process
+    diskcache = None
 
-class cql_output(BaseModel):
-    """Output schema for Confluence Query Language (CQL) queries."""
+_MISSING = object()
 
-    cql: Optional[List[str]] = None
-    failure: Optional[str] = None
-    thoughts: Optional[str] = None
-    keywords: Optional[str] = None
-    synonyms: Optional[str] = None
-    answer: Optional[str] = None
-    warning: Optional[str] = None
+# System prompt for the chunk question-answering calls, unless prompt.md overrides it.
+# These calls have no tools, and must reply through the answer schema they are given.
+CHUNK_ANSWER_INSTRUCTIONS = """
+You answer questions using only the Confluence page excerpts in the user's message.
+Reply through the function you are given. When the message has several numbered
+CONTEXT blocks, give one answer per block and say which block it is for.
+If an excerpt does not answer the question, set failure instead of guessing.
+""".strip()
+
+
+class _TextChunker(HTMLParser):
+    """Collects the text of an HTML document as it is fed, skipping script and style."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self.length = 0
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self._skipping += 1
+        self._separate()
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style") and self._skipping:
+            self._skipping -= 1
+        self._separate()
+
+    def handle_data(self, data):
+        # Data can arrive split at feed boundaries, so it is kept verbatim
+        if not self._skipping:
+            self.parts.append(data)
+            self.length += len(data)
+
+    def _separate(self):
+        """Keeps the text of adjacent elements from running together."""
+        if self.parts and not self.parts[-1][-1:].isspace():
+            self.parts.append(" ")
+            self.length += 1
+
+    def take(self, size: int, final: bool = False) -> Iterator[str]:
+        """Yields full chunks of `size` characters, plus the remainder when final."""
+        while self.length >= size or (final and self.length):
+            text = "".join(self.parts)
+            self.parts, self.length = [text[size:]], max(len(text) - size, 0)
+            yield text[:size]
+
+
+def iter_text_chunks(
+    html: str, size: int = CONTEXT_LIMIT, feed_size: int = 65536
+) -> Iterator[str]:
+    """
+    Streams the text of an HTML document in chunks of at most `size` characters.
+    The document is tokenized incrementally, so only the text of the chunk being
+    filled is held; consumed lazily, chunks can be released as they are used.
+    """
+    parser = _TextChunker()
+    for i in range(0, len(html), feed_size):
+        parser.feed(html[i : i + feed_size])
+        yield from parser.take(size)
+    parser.close()
+    yield from parser.take(size, final=True)
+
+
+class ChunkAnswerCache:
+    """
+    LRU cache of chunk answers, keyed by a digest of (user query, chunk) so that
+    large chunks are not kept alive as keys. Backed by diskcache, and so shared
+    across processes, when FINGERTIPS_CACHE_DIR is set and diskcache is installed.
+    """
+
+    def __init__(self, maxsize: int = 4096, directory: Optional[str] = None):
+        self._maxsize = maxsize
+        self._memory: OrderedDict[str, Optional[str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+        if directory and diskcache is not None:
+            self._disk = diskcache.Cache(
+                directory, eviction_policy="least-recently-used"
+            )
+
+    @staticmethod
+    def key(user_query: str, chunk: str) -> str:
+        return hashlib.sha256(f"{user_query}\0{chunk}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str, default=_MISSING):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+        if self._disk is not None:
+            return self._disk.get(key, default)
+        return default
+
+    def set(self, key: str, answer: Optional[str]) -> None:
+        with self._lock:
+            self._memory[key] = answer
+            self._memory.move_to_end(key)
+            if len(self._memory) > self._maxsize:
+                self._memory.popitem(last=False)
+        if self._disk is not None:
+            self._disk.set(key, answer)
+
+
+chunk_answers = ChunkAnswerCache(directory=os.getenv("FINGERTIPS_CACHE_DIR"))
+
+# Shared by every query: asyncio.run() would otherwise create and tear down a
+# default executor (and its threads) on each call
+_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("FINGERTIPS_POOL", "32")))
+atexit.register(_POOL.shutdown)
+
+
+async def run_in_pool(func, *args, **kwargs):
+    """Runs a blocking call (Confluence, batch polling) on the shared thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_POOL, functools.partial(func, *args, **kwargs))
 
 
 class answer_output(BaseModel):
@@ -38,6 +173,34 @@ class answer_output(BaseModel):
     warning: Optional[str] = None
 
 
+class context_answer_output(answer_output):
+    """Output schema for the answer to one numbered context."""
+
+    context: Optional[int] = None
+
+
+class answer_group_output(BaseModel):
+    """Output schema for answers to several numbered contexts, one per context."""
+
+    answers: List[context_answer_output] = []
+
+
+@functools.lru_cache(maxsize=None)
+def get_openai_manager(
+    confluence_base_url: str, confluence_username: str, confluence_token: str
+) -> OpenAIManager:
+    """
+    One OpenAIManager per set of Confluence credentials. AIChatManager is built per
+    query, and a manager of its own would create a new server-side assistant each
+    time.
+    """
+    return OpenAIManager(
+        confluence_base_url=confluence_base_url,
+        confluence_username=confluence_username,
+        confluence_token=confluence_token,
+    )
+
+
 class AIChatManager:
     def __init__(
         self,
@@ -45,125 +208,175 @@ class AIChatManager:
         confluence_base_url: str,
         confluence_username: str,
         confluence_token: str,
+        use_batch: bool = False,
+        openai_manager: Optional[OpenAIManager] = None,
     ):
-        self.confluence_client = Confluence(
-            url=confluence_base_url,
-            username=confluence_username,
-            password=confluence_token,
-            cloud=True,
+        self.openai_manager = openai_manager or get_openai_manager(
+            confluence_base_url, confluence_username, confluence_token
         )
+        self.confluence_client = self.openai_manager.confluence_client
         self.user_query = user_query
+        self.use_batch = use_batch
+        # prompt.md is a local override of the chunk answering prompt
         path = Path(__file__).parent / "prompt.md"
-        self.system_prompt = path.read_text()
+        self.system_prompt = (
+            path.read_text() if path.exists() else CHUNK_ANSWER_INSTRUCTIONS
+        )
+        self.thread_key = f"aichat-{uuid.uuid4().hex}"
+        self._async_ai = None
+
+    @property
+    def async_ai(self) -> AsyncAIChat:
+        """
+        The chat used to answer chunks, built on first use. Chunk calls run
+        concurrently on it and do not save messages, so they cannot see each other.
+        """
+        if self._async_ai is None:
+            self._async_ai = AsyncAIChat(
+                id="qna", params=self.chat_params(), system=self.system_prompt
+            )
+        return self._async_ai
+
+    @staticmethod
+    def chat_params(chunk_count: int = 1) -> Dict[str, Any]:
+        """Completion parameters for answering chunk_count chunks in one request."""
+        return {
+            "temperature": 0.0,
+            "model": OPENAI_MODEL,
+            "max_tokens": CHUNK_ANSWER_MAX_TOKENS * chunk_count,
+        }
 
-    def get_ai(self) -> AIChat:
+    def generate_response(self, cql_query: Optional[str] = None) -> str:
+        """
+        Answers the user query. By default this is a single assistant run, which
+        searches and loads Confluence pages itself through tool calls. When the
+        caller already has a CQL query, the pages it finds are answered chunk by
+        chunk instead (through the Batch API if use_batch is set).
+        """
         logger.info("Generating response for user query")
-        params = {"temperature": 0.0, "model": OPENAI_MODEL, "max_tokens": 1000}
-        ai = AIChat(
-            id="qna",
-            params=params,
-            system=self.system_prompt,
+        if cql_query is not None:
+            response = asyncio.run(self.process_query(cql_query))
+        else:
+            try:
+                response = self.openai_manager.answer_in_thread(
+                    self.user_query, self.thread_key
+                )
+            except RunError as e:
+                logger.error(e)
+                response = None
+            finally:
+                # Each manager asks a single question, so its thread is not reused
+                self.openai_manager.agent.forget_openai_thread(self.thread_key)
+        return (
+            response
+            or "I'm sorry, I am unable to answer your request. Please paraphrase your question. What information do you seek?"
         )
-        return ai
 
-    def generate_response(
-        self,
-        failed_cql: Optional[List[str]] = [],
-        failure_count: int = 0,
-    ) -> str:
-        ai = self.get_ai()
-
-        user_query = f"""
-        Ponder the user query below very carefully to identify keywords, remove useless information like the company name, and generate effective, efficient CQL queries.
-        Consider synonyms, categories, alternative meanings, and other possibilities.
-        For example, if the user asks about databases, you might not find the word 'databases' but may want to search for common types of databases like 'MySQL', 'Postgresql' or 'MsSQL'.
-        The CQL queries should search the text and titles use all reasonable permutations of OR, and AND, and parentheses to mimimize API calls.
-        Think step by step. We only get one shot at this, so make it count. If the user query is not a valid question, respond as your system message mandates.
-        
-        USER QUERY: 
-        {self.user_query}
-        """
-        if failed_cql:
-            user_query += """
-                FORBIDDEN QUERIES: 
-                The following CQL queries returned no results. Do not use them:
-                """ + "\n- ".join(
-                failed_cql
-            )
+    async def process_query(self, query):
+        """Processes a query with the Confluence API."""
+        logger.info(f"Processing query: {query}")
+        results = await run_in_pool(self.confluence_client.cql, query, limit=5)
 
-        ai_response = ai(user_query, id="qna", output_schema=cql_output)
+        # Load every page at once, bounded by a single semaphore, then answer their
+        # chunks as they are extracted
+        semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+        pages = await asyncio.gather(
+            *(self.process_result(result, semaphore) for result in results["results"])
+        )
+        chunk_pages = []
 
-        if warning := ai_response.get("warning"):
-            logger.warning(warning)
-            return "I'm sorry, I am unable to answer your request. Please paraphrase your question. What information do you seek?"
+        def page_chunks() -> Iterator[str]:
+            for page, chunks in pages:
+                for chunk in chunks:
+                    chunk_pages.append(page)
+                    yield chunk
 
-        if failure := ai_response.get("failure"):
-            logger.error(failure)
-            return "I'm sorry, I am unable to answer your request. Please paraphrase your question. What information do you seek?"
+        answers = await self.answer_chunks(page_chunks(), semaphore)
+        answers = [
+            f'Page ID{page["id"]}: {answer}, Refs: {page["_links"]["webui"]}'
+            for page, answer in zip(chunk_pages, answers)
+            if answer is not None
+        ]
+        return "\n".join(answers)
 
-        if answer := ai_response.get("answer"):
-            logger.info(answer)
-            return answer
+    async def answer_chunks(
+        self, chunks: Iterable[str], semaphore
+    ) -> List[Optional[str]]:
+        """
+        Answers each chunk, asking the LLM only about chunks that have not been seen
+        with this question before (e.g. navigation or footer text shared by pages).
+        Chunks are consumed lazily: online, each group is sent as soon as it is full
+        and no more text is extracted while MAX_CONCURRENCY groups are in flight.
+        """
+        keys: List[str] = []
+        resolved: Dict[str, Optional[str]] = {}
+        queued: Set[str] = set()
 
-        if cql := ai_response.get("cql"):
-            logger.info("Number of cql queries: " + str(len(cql)))
-            query = " OR ".join([f"({cql})" for cql in cql])
-            response = self.process_query(query)
+        def uncached(chunks: Iterable[str]) -> Iterator[str]:
+            """Yields the chunks without a cached answer, each distinct chunk once."""
+            for chunk in chunks:
+                key = chunk_answers.key(self.user_query, chunk)
+                keys.append(key)
+                if key in resolved or key in queued:
+                    continue
+                answer = chunk_answers.get(key)
+                if answer is _MISSING:
+                    queued.add(key)
+                    yield chunk
+                else:
+                    resolved[key] = answer
 
-            if response == "":
-                failure_count += 1
-                failed_cql.extend(cql)
-                if failure_count < 2:
-                    response = self.generate_response(failed_cql, failure_count)
-            else:
-                return response
+        def record(chunks: List[str], answers: List[Optional[str]]) -> None:
+            for chunk, answer in zip(chunks, answers):
+                key = chunk_answers.key(self.user_query, chunk)
+                # Chunks the model returned nothing for are retried next time
+                if answer is _MISSING:
+                    answer = None
+                else:
+                    chunk_answers.set(key, answer)
+                resolved[key] = answer
 
-        return "I'm sorry, I am unable to answer your request. Please paraphrase your question. What information do you seek?"
+        if self.use_batch:
+            pending = list(uncached(chunks))
+            if pending:
+                record(pending, await run_in_pool(self.process_chunks_batched, pending))
+        else:
+            in_flight = asyncio.Semaphore(MAX_CONCURRENCY)
 
-    def process_query(self, query):
-        """Processes a query with the Confluence API."""
-        logger.info(f"Processing query: {query}")
-        with ThreadPoolExecutor(max_workers=5) as results_executor:
-            results = self.confluence_client.cql(query, limit=5)
+            async def answer_group(group: List[str]) -> None:
+                try:
+                    record(group, await self.process_chunk_group(group, semaphore))
+                finally:
+                    in_flight.release()
 
-            answers = list(
-                results_executor.map(self.process_result, results["results"])
-            )
-            answers = [answer for answer in answers if answer is not None]
-            return "\n".join(answers)
+            tasks = []
+            for group in self.group_chunks(uncached(chunks)):
+                await in_flight.acquire()
+                tasks.append(asyncio.create_task(answer_group(group)))
+            await asyncio.gather(*tasks)
 
-    def process_result(self, result):
-        """Processes the result from the Confluence API."""
-        expanded_result = self.confluence_client.get_page_by_id(
-            result["content"]["id"], expand="body.view"
-        )
-        content_body = expanded_result["body"]["view"]["value"]
-        # Strip any HTML tags from content_body
-        content_body = re.sub("<.*?>", "", content_body)
-        # Chunk content body if necessary
-        chunks = [
-            content_body[i : i + CONTEXT_LIMIT]
-            for i in range(0, len(content_body), CONTEXT_LIMIT)
-        ]
+        return [resolved[key] for key in keys]
 
-        # Initialize ThreadPoolExecutor
-        with ThreadPoolExecutor(max_workers=5) as chunk_executor:
-            # Process each chunk with OpenAI GPT-4 using ThreadPoolExecutor
-            answers = list(chunk_executor.map(self.process_chunk, chunks))
-            answers = [
-                f'Page ID{result["content"]["id"]}: {answer}, Refs: {expanded_result["_links"]["webui"]}'
-                for answer in answers
-                if answer is not None
-            ]
-
-            if answers:
-                return "\n".join(answers)
-            else:
-                return None
+    async def process_result(self, result, semaphore):
+        """
+        Loads the page for a Confluence search result. Returns the page, without its
+        body, and an iterator over the body's text chunks.
+        """
+        async with semaphore:
+            expanded_result = await run_in_pool(
+                self.confluence_client.get_page_by_id,
+                result["content"]["id"],
+                expand="body.view",
+            )
+        # Only the chunk iterator keeps the raw HTML, so it is freed once the page's
+        # chunks have all been extracted
+        return expanded_result, iter_text_chunks(
+            expanded_result.pop("body")["view"]["value"]
+        )
 
-    def process_chunk(self, chunk):
-        """Processes a chunk with OpenAI GPT-4."""
-        ai_query = f"""
+    def chunk_query(self, chunk):
+        """Builds the question-answering prompt for a single chunk."""
+        return f"""
             Answer the following question: {self.user_query}, using only the context provided at the end of this message.
             If there is no answer, respond with 'failure: I'm sorry, inadequate info.'.
             Do not include the question in your response. Use only the context above to answer the question.
@@ -172,9 +385,9 @@ class AIChatManager:
             {chunk}
             
         """
-        ai = self.get_ai()
-        ai_response = ai(ai_query, id="qna", output_schema=answer_output)
 
+    def extract_answer(self, ai_response):
+        """Logs any warning or failure in a chunk response and returns its answer."""
         if warning := ai_response.get("warning"):
             logger.warning(warning)
 
@@ -183,3 +396,183 @@ class AIChatManager:
 
         if answer := ai_response.get("answer"):
             return answer
+
+    async def process_chunk(self, chunk, semaphore):
+        """Processes a chunk with OpenAI GPT-4."""
+        ai_query = self.chunk_query(chunk)
+        async with semaphore:
+            await rate_limiter.acquire_async(estimate_tokens(ai_query))
+            ai_response = await self.async_ai(
+                ai_query, id="qna", save_messages=False, output_schema=answer_output
+            )
+        return self.extract_answer(ai_response)
+
+    async def process_chunk_or_missing(self, chunk, semaphore):
+        """Like process_chunk, but a failed request leaves the chunk as _MISSING."""
+        try:
+            return await self.process_chunk(chunk, semaphore)
+        except Exception as e:
+            logger.error(f"Failed to answer chunk: {e}")
+            return _MISSING
+
+    def chunk_group_query(self, chunks: List[str]) -> str:
+        """Builds one prompt asking for an answer per numbered context block."""
+        contexts = "\n\n".join(
+            f"CONTEXT {i}:\n{chunk}" for i, chunk in enumerate(chunks, start=1)
+        )
+        return f"""
+            Answer the following question for each CONTEXT block below, using only that block: {self.user_query}
+            Return exactly one entry in `answers` per CONTEXT block, with `context` set to that block's number.
+            If a block has no answer, set that entry's failure to 'I'm sorry, inadequate info.'.
+            Do not include the question in your response.
+            
+            {contexts}
+            
+        """
+
+    def group_chunks(self, chunks: Iterable[str]) -> Iterator[List[str]]:
+        """
+        Packs consecutive chunks into groups of at most CHUNK_GROUP_SIZE that fit in
+        the context window together, so the instructions are sent once per group.
+        Each group is yielded as soon as the next chunk would not fit in it.
+        """
+        budget = CONTEXT_LIMIT - len(self.chunk_group_query([]))
+        group: List[str] = []
+        group_length = 0
+        for chunk in chunks:
+            if group and (
+                len(group) >= CHUNK_GROUP_SIZE or group_length + len(chunk) > budget
+            ):
+                yield group
+                group, group_length = [], 0
+            group.append(chunk)
+            group_length += len(chunk)
+        if group:
+            yield group
+
+    async def process_chunk_group(
+        self, chunks: List[str], semaphore
+    ) -> List[Optional[str]]:
+        """
+        Answers several chunks with one OpenAI request. If the request fails, e.g. on
+        a truncated function-call reply, the chunks are answered one by one instead,
+        so a bad group does not fail the whole query.
+        """
+        if len(chunks) == 1:
+            return [await self.process_chunk_or_missing(chunks[0], semaphore)]
+
+        ai_query = self.chunk_group_query(chunks)
+        try:
+            async with semaphore:
+                await rate_limiter.acquire_async(estimate_tokens(ai_query))
+                ai_response = await self.async_ai(
+                    ai_query,
+                    id="qna",
+                    save_messages=False,
+                    params=self.chat_params(len(chunks)),
+                    output_schema=answer_group_output,
+                )
+        except Exception as e:
+            logger.warning(
+                f"Failed to answer a group of {len(chunks)} chunks, "
+                f"answering them one by one: {e}"
+            )
+            return list(
+                await asyncio.gather(
+                    *(self.process_chunk_or_missing(c, semaphore) for c in chunks)
+                )
+            )
+
+        return self.match_group_answers(ai_response.get("answers") or [], len(chunks))
+
+    def match_group_answers(
+        self, responses: List[dict], chunk_count: int
+    ) -> List[Optional[str]]:
+        """
+        Orders a group's answers by the CONTEXT number each one names. The model can
+        skip or merge blocks, so list position is not trusted; chunks without an
+        answer of their own are left as _MISSING.
+        """
+        answers: List[Optional[str]] = [_MISSING] * chunk_count
+        for response in responses:
+            context = response.get("context")
+            if isinstance(context, int) and 1 <= context <= chunk_count:
+                if answers[context - 1] is _MISSING:
+                    answers[context - 1] = self.extract_answer(response)
+            else:
+                logger.warning(f"Group answer with invalid context: {context}")
+        return answers
+
+    def process_chunks_batched(self, chunks: List[str]) -> List[Optional[str]]:
+        """
+        Answers every chunk through the OpenAI Batch API. Much cheaper than the online
+        path, but takes seconds to hours, so it is only used when use_batch is set.
+        Chunks whose request failed are left as _MISSING.
+        """
+        if not chunks:
+            return []
+
+        # Batches have their own quota, so they bypass the online rate limiter; it
+        # would otherwise charge the whole JSONL upload against the token budget
+        client = OpenAI()
+        function = {
+            "name": "answer_output",
+            "description": answer_output.__doc__,
+            "parameters": answer_output.model_json_schema(),
+        }
+        requests = [
+            {
+                "custom_id": f"c{i}",
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": OPENAI_MODEL,
+                    "temperature": 0.0,
+                    "max_tokens": CHUNK_ANSWER_MAX_TOKENS,
+                    "messages": [
+                        {"role": "system", "content": self.system_prompt},
+                        {"role": "user", "content": self.chunk_query(chunk)},
+                    ],
+                    "tools": [{"type": "function", "function": function}],
+                    "tool_choice": {
+                        "type": "function",
+                        "function": {"name": "answer_output"},
+                    },
+                },
+            }
+            for i, chunk in enumerate(chunks)
+        ]
+        batch_input = "\n".join(json.dumps(request) for request in requests)
+        batch_file = client.files.create(
+            file=("chunks.jsonl", batch_input.encode("utf-8")), purpose="batch"
+        )
+        batch = client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        logger.info(f"Submitted batch {batch.id} with {len(chunks)} chunks")
+
+        delay = BATCH_POLL_INITIAL_DELAY
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(delay)
+            delay = min(delay * 2, BATCH_POLL_MAX_DELAY)
+            batch = client.batches.retrieve(batch.id)
+
+        answers: List[Optional[str]] = [_MISSING] * len(chunks)
+        if batch.status != "completed" or batch.output_file_id is None:
+            logger.error(f"Batch {batch.id} finished with status {batch.status}")
+            return answers
+
+        for line in client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            output = json.loads(line)
+            response = output.get("response") or {}
+            if output.get("error") or response.get("status_code") != 200:
+                logger.error(f"Batch request {output['custom_id']} failed: {output}")
+                continue
+            message = response["body"]["choices"][0]["message"]
+            ai_response = json.loads(message["tool_calls"][0]["function"]["arguments"])
+            answers[int(output["custom_id"][1:])] = self.extract_answer(ai_response)
+        return answers
@@ -1,9 +1,17 @@
-from typing import Any, Dict, List
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional
 
 from atlassian import Confluence
 
 from work.fingertips.confluence.agents.openai import OpenAIAgent
 
+logger = logging.getLogger(__name__)
+
+# answer_one asks the assistant to start its reply with this when a result does not
+# answer the question
+FAILURE_PREFIX = "failure:"
+
 
 class OpenAIManager:
     """
@@ -48,6 +56,13 @@ class OpenAIManager:
         Pass the user_query to the assistant and return the response.
         """
         thread_key = self.get_session_thread_key(slack_user, slack_channel)
+        return self.answer_in_thread(user_query, thread_key)
+
+    def answer_in_thread(self, user_query: str, thread_key: str) -> str:
+        """
+        Pass the user_query to the assistant on the given thread and return the
+        response. The assistant calls the Confluence tools itself as needed.
+        """
         response = self.agent.send_message(user_query, thread_key)
         response = [
             msg.content[0].text.value
@@ -106,37 +121,95 @@ class OpenAIManager:
             [f"({query.content[0].text.value})" for query in cql_queries]
         )
 
+    def send_openai_message_await_responses(self, message: str, thread_key: str):
+        """
+        Send a message to the assistant on the given thread and return its replies.
+        """
+        return self.agent.send_message(message, thread_key)
+
     def formulate_answer(
         self,
         user_query: str,
-        results: List[Dict[str, Any]],
+        results: Dict[str, Any],
         thread_key: str,
     ) -> str:
         """
         Formulate an answer based on the results from the CQL query.
         """
-        if not results:
+        if not results or not results.get("results"):
             return "I couldn't find any information related to your query."
 
-        # Iterate over results to find an answer
-        for result in results:
-            ai_query = f"""
-                Answer the following question: {user_query}, using only the context provided at the end of this message.
-                If there is no answer, respond with 'failure: I'm sorry, inadequate info.'.
-                Do not include the question in your response. Use only the context above to answer the question.
-                
-                Context:
-                {result["results"]}
-                
-            """
-            answers = self.send_openai_message_await_responses(ai_query, thread_key)
-
-            # Placeholder for logic to check if the result answers the user's query
-            # if self._is_relevant_result(user_query, result):
-            for answer in answers:
-                page_id = result["id"]
-                title = result["title"]
-                url = f"{self.confluence_base_url}/wiki/spaces/{result['_expandable']['space']}/pages/{page_id}"
-                return f"I found some information that might help you: *{title}* <{url}|View on Confluence>"
+        # A pool of its own, so returning early does not wait for the slower calls
+        # the way the default executor's shutdown would
+        executor = ThreadPoolExecutor(max_workers=len(results["results"]))
+        try:
+            # Each result gets its own assistant thread: a thread only allows one
+            # active run
+            futures = {
+                executor.submit(
+                    self.answer_one, user_query, result, f"{thread_key}:{index}"
+                ): index
+                for index, result in enumerate(results["results"])
+            }
+            answers: Dict[int, Optional[str]] = {}
+            best = 0
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = futures[future]
+                    if future.exception() is not None:
+                        logger.error(
+                            f"Failed to answer from result: {future.exception()}"
+                        )
+                        answers[index] = None
+                    else:
+                        answers[index] = future.result()
+                # Keep the CQL ranking: a result's answer is only returned once every
+                # higher-ranked result has failed to answer
+                while best in answers:
+                    if answers[best]:
+                        return answers[best]
+                    best += 1
+        finally:
+            # Calls already running finish in the background, but are ignored
+            executor.shutdown(wait=False, cancel_futures=True)
 
         return "I found some information, but nothing that directly answers your question. Please check the search results on Confluence."
+
+    def answer_one(
+        self, user_query: str, result: Dict[str, Any], thread_key: str
+    ) -> Optional[str]:
+        """
+        Ask the assistant whether a single search result answers the user query.
+        Returns a link to the result, or None if the assistant replied with the
+        failure sentinel or not at all.
+        """
+        ai_query = f"""
+            Answer the following question: {user_query}, using only the context provided at the end of this message.
+            If there is no answer, respond with 'failure: I'm sorry, inadequate info.'.
+            Do not include the question in your response. Use only the context above to answer the question.
+            
+            Context:
+            {result}
+            
+        """
+        try:
+            answers = self.send_openai_message_await_responses(ai_query, thread_key)
+        finally:
+            # The thread is only used for this one question
+            self.agent.forget_openai_thread(thread_key)
+
+        replies = [
+            msg.content[0].text.value.strip()
+            for msg in answers
+            if msg.content[0].type == "text" and msg.content[0].text.value.strip()
+        ]
+        if replies and not any(
+            reply.lower().startswith(FAILURE_PREFIX) for reply in replies
+        ):
+            content = result["content"]
+            title = result.get("title", content.get("title"))
+            url = f"{self.confluence_base_url}/wiki{content['_links']['webui']}"
+            return f"I found some information that might help you: *{title}* <{url}|View on Confluence>"
+        return None
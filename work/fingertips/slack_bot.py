@@ -1,153 +1,398 @@
+import asyncio
+import hashlib
 import logging
 import os
 import sys
-from functools import lru_cache
-from typing import Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Coroutine, Dict, List, Optional, Set, Tuple
 
+from cachetools import TTLCache
 from dotenv import load_dotenv
-from slack_bolt import App
+from slack_bolt.async_app import AsyncApp
+from slack_sdk.http_retry.builtin_async_handlers import AsyncRateLimitErrorRetryHandler
 
+from work.fingertips.confluence.clients.redis_cache import shared_cache
+from work.fingertips.confluence.clients.semantic_cache import SemanticCache
 from work.fingertips.confluence.managers.openai import OpenAIManager
+from work.fingertips.slack_messages import split_message
 
 load_dotenv()
 
-CONTEXT_LIMIT = os.getenv("OPENAI_MODEL_CONTEXT_LIMIT", 100000)
+CONTEXT_LIMIT = int(os.getenv("OPENAI_MODEL_CONTEXT_LIMIT", "100000"))
 OPENAI_MODEL = os.getenv("OPENAI_MODEL")
 
 # Initialize the Bolt app with the bot token and signing secret
-slack_app = App(
+slack_app = AsyncApp(
     token=os.getenv("SLACK_BOT_TOKEN"), signing_secret=os.getenv("SLACK_SIGNING_SECRET")
 )
+# On HTTP 429, wait out Slack's Retry-After and retry instead of losing the event
+slack_app.client.retry_handlers.append(
+    AsyncRateLimitErrorRetryHandler(
+        max_retry_count=int(os.getenv("SLACK_RATE_LIMIT_RETRIES", 3))
+    )
+)
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)  # Set global logging level to DEBUG
 
-# Create a handler for stdout, set level to INFO
-stdout_handler = logging.StreamHandler(sys.stdout)
-stdout_handler.setLevel(logging.INFO)
-
-# Create a handler for stderr, set level to WARNING
-stderr_handler = logging.StreamHandler(sys.stderr)
-stderr_handler.setLevel(logging.WARNING)
+# Configure handlers once, even if the module is imported or reloaded again
+if not logger.handlers:
+    # Create a handler for stdout, set level to INFO
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    stdout_handler.setLevel(logging.INFO)
 
-# Add both handlers to the logger
-logger.addHandler(stdout_handler)
-logger.addHandler(stderr_handler)
-formatter = logging.Formatter("%(filename)s:%(lineno)d - %(message)s")
-stdout_handler.setFormatter(formatter)
-stderr_handler.setFormatter(formatter)
+    # Create a handler for stderr, set level to WARNING
+    stderr_handler = logging.StreamHandler(sys.stderr)
+    stderr_handler.setLevel(logging.WARNING)
 
+    # Add both handlers to the logger
+    logger.addHandler(stdout_handler)
+    logger.addHandler(stderr_handler)
+    formatter = logging.Formatter("%(filename)s:%(lineno)d - %(message)s")
+    stdout_handler.setFormatter(formatter)
+    stderr_handler.setFormatter(formatter)
 
 logger.info("Initialized Confluence API and Slack App")
 
 
+# Slack events are acknowledged immediately and answered in background tasks. The
+# blocking Confluence/OpenAI work runs on these worker threads.
+EXECUTOR = ThreadPoolExecutor(max_workers=int(os.getenv("WORKER_THREADS", 10)))
+
+# Strong references to in-flight tasks, so they are not garbage collected mid-run
+background_tasks: Set[asyncio.Task] = set()
+
+
+def run_in_background(coro: Coroutine) -> None:
+    """Schedules coro on the event loop, logging any exception it raises."""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(finish_background_task)
+
+
+def finish_background_task(task: asyncio.Task) -> None:
+    """Logs the exception of a failed background task, which would otherwise be lost."""
+    background_tasks.discard(task)
+    if not task.cancelled() and (exception := task.exception()):
+        logger.error("Background task failed", exc_info=exception)
+
+
+# Messages waiting to be answered together, keyed by (channel or user, thread_ts,
+# user) so that different people's questions are never merged
+DEBOUNCE_SECONDS = float(os.getenv("DEBOUNCE_SECONDS", 0.75))
+PendingKey = Tuple[str, Optional[str], Optional[str]]
+pending_queries: Dict[PendingKey, Dict[str, Any]] = {}
+pending_timers: Dict[PendingKey, asyncio.TimerHandle] = {}
+
+# Messages already queued, keyed by (channel, ts). A mention in a thread arrives
+# as both an app_mention and a message event, and must be answered once.
+SEEN_MESSAGES: TTLCache = TTLCache(maxsize=4096, ttl=300)
+
+
 confluence_helper = OpenAIManager(
     confluence_base_url=os.getenv("CONFLUENCE_URL"),
     confluence_username=os.getenv("CONFLUENCE_USERNAME"),
     confluence_token=os.getenv("CONFLUENCE_API_TOKEN"),
 )
 
+FALLBACK_RESPONSE = (
+    "I'm sorry, I couldn't find an answer to that. Please try rephrasing your question."
+)
+
+# Answers to earlier questions, reused for paraphrases asked in the same channel
+response_cache = SemanticCache(shared=shared_cache)
+
+
+def answer_query(user_query: str, user: str, channel: str) -> str:
+    """Answers user_query, reusing a cached answer to a similar earlier question."""
+    return response_cache.get_or_answer(
+        channel or user,
+        user_query,
+        lambda: confluence_helper.answer(user_query, user, channel),
+    )
+
+
+# These in-process caches are checked first. When REDIS_URL is set, Redis backs
+# them so that every worker shares what any one of them has fetched.
+
+# Bot identity, keyed by token so a rotated token fetches fresh info
+BOT_INFO_TTL = int(os.getenv("BOT_INFO_TTL", 86400))
+MY_INFO_CACHE: TTLCache = TTLCache(maxsize=1, ttl=BOT_INFO_TTL)
+
+# Recent thread histories, so a burst of replies in one thread fetches it once
+THREAD_HISTORY_TTL = int(os.getenv("THREAD_HISTORY_TTL", 30))
+THREAD_HISTORY_CACHE: TTLCache = TTLCache(maxsize=1024, ttl=THREAD_HISTORY_TTL)
+
+# Replies come oldest first, so the whole thread is paged through to reach the
+# newest ones
+THREAD_HISTORY_PAGE_SIZE = int(os.getenv("THREAD_HISTORY_PAGE_SIZE", 200))
+
+
+async def get_my_info() -> Dict[str, Any]:
+    """Fetches bot info and caches it for BOT_INFO_TTL seconds."""
+    token = slack_app.client.token
+    if (my_info := MY_INFO_CACHE.get(token)) is None:
+        # The token is a secret, so Redis only sees its digest
+        shared_key = f"my_info:{hashlib.sha256(token.encode()).hexdigest()}"
+        if shared_cache:
+            my_info = await asyncio.to_thread(shared_cache.get, shared_key)
+        if my_info is None:
+            logger.info("Fetching bot info")
+            my_info = (await slack_app.client.auth_test()).data
+            if shared_cache:
+                await asyncio.to_thread(
+                    shared_cache.set, shared_key, my_info, BOT_INFO_TTL
+                )
+        MY_INFO_CACHE[token] = my_info
+    return my_info
+
+
+async def get_thread_messages(channel: str, thread_ts: str) -> List[Dict[str, Any]]:
+    """Fetches a thread's history, reusing it for THREAD_HISTORY_TTL seconds."""
+    key = (channel, thread_ts)
+    if (messages := THREAD_HISTORY_CACHE.get(key)) is None:
+        if shared_cache:
+            messages = await asyncio.to_thread(
+                shared_cache.get, thread_history_key(channel, thread_ts)
+            )
+        if messages is None:
+            messages = await fetch_thread_messages(channel, thread_ts)
+            if shared_cache:
+                await asyncio.to_thread(
+                    shared_cache.set,
+                    thread_history_key(channel, thread_ts),
+                    messages,
+                    THREAD_HISTORY_TTL,
+                )
+        THREAD_HISTORY_CACHE[key] = messages
+    return messages
+
+
+async def fetch_thread_messages(channel: str, thread_ts: str) -> List[Dict[str, Any]]:
+    """Fetches every message in a thread, oldest first."""
+    messages: List[Dict[str, Any]] = []
+    cursor = None
+    while True:
+        thread_history = await slack_app.client.conversations_replies(
+            channel=channel, ts=thread_ts, limit=THREAD_HISTORY_PAGE_SIZE, cursor=cursor
+        )
+        messages.extend(thread_history.data.get("messages", []))
+        cursor = thread_history.data.get("response_metadata", {}).get("next_cursor")
+        if not cursor:
+            return messages
+
+
+def thread_history_key(channel: str, thread_ts: str) -> str:
+    return f"thread_history:{channel}:{thread_ts}"
+
+
+async def forget_thread_messages(channel: str, thread_ts: Optional[str]) -> None:
+    """Drops a thread's cached history, e.g. after posting to it."""
+    THREAD_HISTORY_CACHE.pop((channel, thread_ts), None)
+    if shared_cache and channel and thread_ts:
+        await asyncio.to_thread(
+            shared_cache.delete, thread_history_key(channel, thread_ts)
+        )
+
 
-@lru_cache
-def get_my_info() -> str:
-    """Fetches bot info and caches it."""
-    logger.info("Fetching bot info")
-    return slack_app.client.auth_test().data
+# chat.postMessage allows about one message per second per channel. This holds the
+# time each channel's next post may be sent.
+SLACK_POST_INTERVAL = float(os.getenv("SLACK_POST_INTERVAL", 1))
+NEXT_POST_TIMES: TTLCache = TTLCache(maxsize=1024, ttl=300)
 
 
-def speaking_to_me(body: Any) -> bool:
+async def post_message(channel: str, text: str, thread_ts: Optional[str]) -> None:
+    """Posts a message, spacing posts to a channel SLACK_POST_INTERVAL seconds apart."""
+    now = asyncio.get_running_loop().time()
+    # Reserve a slot before awaiting, so concurrent posts queue up behind each other
+    send_at = max(now, NEXT_POST_TIMES.get(channel, now))
+    NEXT_POST_TIMES[channel] = send_at + SLACK_POST_INTERVAL
+    if send_at > now:
+        await asyncio.sleep(send_at - now)
+    await slack_app.client.chat_postMessage(
+        channel=channel, text=text, thread_ts=thread_ts
+    )
+
+
+# Slack truncates long messages, so longer replies are sent as several posts
+SLACK_MESSAGE_LIMIT = int(os.getenv("SLACK_MESSAGE_LIMIT", 3500))
+
+
+async def speaking_to_me(body: Any) -> bool:
     """Checks if the bot was mentioned in the message."""
-    logger.info("Checking if the bot was mentioned")
+    logger.debug("Checking if the bot was mentioned")
     event = body["event"]
-    app_mention = "app_mention" in event.get("type")
+    app_mention = event.get("type", "") == "app_mention"
     im = event.get("channel_type") == "im"
 
+    # Mentions and DMs are always for me, no need to look at the thread
+    if app_mention or im:
+        return True
+
     # If the message is part of a thread that the bot is in
     my_thread = False
     if "thread_ts" in event:
         # Fetch the thread's history
-        thread_history = slack_app.client.conversations_replies(
-            channel=event["channel"], ts=event["thread_ts"]
-        )
-
-        # Check all messages in the thread
-        messages = thread_history.data.get("messages", [])
-        for message_index, message in enumerate(messages):
-            # Check if I sent any of the messages in the thread
-            if message.get("bot_id") == get_my_info().get("bot_id"):
-                if message_index < len(messages) - 1:
-                    # This isn't the last message in the thread, so the bot is in the thread
-                    my_thread = True
-                else:
-                    # This is the last message in the thread, so the bot sent the most recent message
-                    # And shouldn't respond to itself
-                    my_thread = False
-
-            # Check if I was mentioned in any of the messages
-            if f"<@{get_my_info().get('user')}>" in message.get("text", "").lower():
+        messages = await get_thread_messages(event["channel"], event["thread_ts"])
+        # A cached history can predate this message, which is the latest in the thread
+        if event.get("ts") and (not messages or messages[-1].get("ts") != event["ts"]):
+            messages = [*messages, event]
+
+        # Walk back from the most recent message; the first one that is mine or
+        # mentions me decides
+        my_info = await get_my_info()
+        my_bot_id = my_info.get("bot_id")
+        my_mention_token = f"<@{my_info.get('user')}>".lower()
+        for message_index in range(len(messages) - 1, -1, -1):
+            message = messages[message_index]
+            # Check if I was mentioned in this message
+            if my_mention_token in message.get("text", "").lower():
                 my_thread = True
-    return app_mention or im or my_thread
+                break
+            # Check if I sent this message
+            if message.get("bot_id") == my_bot_id:
+                # If I sent the most recent message, I shouldn't respond to myself
+                my_thread = message_index < len(messages) - 1
+                break
+    return my_thread
 
 
 @slack_app.event("app_mention")
-def handle_app_mention_events(body: Any, logger: Any) -> None:
+async def handle_app_mention_events(ack: Any, body: Any, logger: Any) -> None:
     """Handles app mention events."""
-    logger.info("Handling app mention events")
-    generate_response(body, source="handle_app_mention_events")
+    # Acknowledge within Slack's 3 second window; the LLM call runs out-of-band
+    await ack()
+    logger.debug("Handling app mention events")
+    run_in_background(generate_response(body, source="handle_app_mention_events"))
 
 
 @slack_app.event("message")
-def handle_message_events(body: Any, logger: Any) -> None:
+async def handle_message_events(ack: Any, body: Any, logger: Any) -> None:
     """Handles message events."""
-    logger.info("Handling message events")
+    await ack()
+    logger.debug("Handling message events")
+    run_in_background(respond_if_speaking_to_me(body))
+
+
+async def respond_if_speaking_to_me(body: Any) -> None:
+    """Generates a response for message events addressed to the bot."""
     if (
         body.get("event", {}).get("subtype") != "bot_message"
-        and "app_mention" not in body.get("event", {}).get("type")
-        and speaking_to_me(body)
+        and body.get("event", {}).get("type") != "app_mention"
+        and await speaking_to_me(body)
     ):
-        generate_response(body, source="handle_message_events")
+        await generate_response(body, source="handle_message_events")
 
 
-def generate_response(body: Any, source=None) -> None:
-    """Generates response for the given event."""
-    logger.info("Generating response")
+async def generate_response(body: Any, source=None) -> None:
+    """
+    Queues the event's text for a response. Messages from the same user arriving in
+    the same thread within DEBOUNCE_SECONDS of each other are answered together in
+    one call.
+    """
+    logger.debug("Generating response for %s", source)
     event = body["event"]
-    channel = body["event"].get("channel")
-    user = body["event"].get("user")
+    channel = event.get("channel")
+    user = event.get("user")
     thread_ts = event.get("thread_ts")
-
-    user_query = body["event"].get("text")
-
-    response = confluence_helper.answer(user_query, user, channel)
-
-    if channel:
-        logger.info("Posting message to channel")
-        slack_app.client.chat_postMessage(
-            channel=channel, text=response, thread_ts=thread_ts
-        )
-    else:
-        logger.info("Posting message to user")
-        slack_app.client.chat_postMessage(
-            channel=user, text=response, thread_ts=thread_ts
+    user_query = event.get("text")
+
+    if ts := event.get("ts"):
+        if (channel, ts) in SEEN_MESSAGES:
+            logger.debug("Skipping message %s, already queued", ts)
+            return
+        SEEN_MESSAGES[(channel, ts)] = True
+
+    key = (channel or user, thread_ts, user)
+    pending = pending_queries.setdefault(
+        key,
+        {
+            "channel": channel,
+            "user": user,
+            "thread_ts": thread_ts,
+            # Top-level messages have no thread, so a split reply starts one here
+            "reply_ts": thread_ts or event.get("ts"),
+            "queries": [],
+        },
+    )
+    pending["queries"].append(user_query)
+
+    if timer := pending_timers.get(key):
+        timer.cancel()
+    pending_timers[key] = asyncio.get_running_loop().call_later(
+        DEBOUNCE_SECONDS, flush_pending, key
+    )
+
+
+def flush_pending(key: PendingKey) -> None:
+    """
+    Timer callback that takes a thread's queued messages off the queue and answers
+    them. Taking them here, rather than in the task, means a message arriving before
+    the task runs starts a new batch instead of joining one that is already closed.
+    """
+    pending_timers.pop(key, None)
+    if (pending := pending_queries.pop(key, None)) is not None:
+        run_in_background(answer_pending(pending))
+
+
+async def answer_pending(pending: Dict[str, Any]) -> None:
+    """Answers a batch of queued messages with a single call and posts the reply."""
+    channel = pending["channel"]
+    user = pending["user"]
+    thread_ts = pending["thread_ts"]
+    user_query = "\n".join(pending["queries"])
+
+    # The assistant client is synchronous, so keep it off the event loop
+    try:
+        response = await asyncio.get_running_loop().run_in_executor(
+            EXECUTOR, answer_query, user_query, user, channel
         )
+    except Exception:
+        logger.exception("Failed to answer query")
+        response = None
+    # Slack rejects empty messages, and the user should know the bot gave up
+    response = response or FALLBACK_RESPONSE
+
+    # Without a channel, reply to the user directly
+    target = channel or user
+    chunks = split_message(response, SLACK_MESSAGE_LIMIT)
+    if len(chunks) > 1:
+        # Keep the parts of a long reply together in one thread
+        thread_ts = pending["reply_ts"]
+    logger.debug("Posting %d message(s) to %s", len(chunks), target)
+    for chunk in chunks:
+        await post_message(target, chunk, thread_ts)
+
+    # The thread now has a reply from me that a cached history would not show
+    await forget_thread_messages(channel, thread_ts)
 
 
 if __name__ == "__main__":
-    if 0:
-        slack_app.start(port=int(os.environ.get("PORT", 3000)))
-
-    # Testing
-    else:
+    if os.getenv("RUN_BENCHMARK"):
+        # Answer one query under the profiler; inspect with `python -m pstats <file>`
+        import cProfile
+        import pstats
         import time
 
+        profile_path = os.getenv("BENCHMARK_PROFILE", "slack_bot.prof")
+        profiler = cProfile.Profile()
         start_time = time.time()
 
-        print(
-            confluence_helper.answer(
-                # "What is the buddy system?", "U01UJ9ZLZ9Z", "C01UJ9ZLZ9Z"
-                "What is the API documentation URL for the enterprise product?",
-                "U01UJ9ZLZ9Z",
-                "C01UJ9ZLZ9Z",
+        with profiler:
+            print(
+                confluence_helper.answer(
+                    # "What is the buddy system?", "U01UJ9ZLZ9Z", "C01UJ9ZLZ9Z"
+                    "What is the API documentation URL for the enterprise product?",
+                    "U01UJ9ZLZ9Z",
+                    "C01UJ9ZLZ9Z",
+                )
             )
-        )
         print("--- %s seconds ---" % (time.time() - start_time))
+
+        profiler.dump_stats(profile_path)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+        print(f"Profile written to {profile_path}")
+    else:
+        # Resolve the bot identity before the first event arrives
+        asyncio.run(get_my_info())
+        slack_app.start(port=int(os.environ.get("PORT", 3000)))
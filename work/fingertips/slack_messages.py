@@ -0,0 +1,24 @@
+from typing import List
+
+
+def split_message(text: str, limit: int) -> List[str]:
+    """Splits text into chunks of at most limit characters, preferably between paragraphs."""
+    chunks: List[str] = []
+    current = ""
+    for paragraph in text.split("\n\n"):
+        # A paragraph too long for one message is cut at the limit
+        while len(paragraph) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(paragraph[:limit])
+            paragraph = paragraph[limit:]
+        candidate = f"{current}\n\n{paragraph}" if current else paragraph
+        if len(candidate) > limit:
+            chunks.append(current)
+            current = paragraph
+        else:
+            current = candidate
+    if current or not chunks:
+        chunks.append(current)
+    return chunks